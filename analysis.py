@@ -0,0 +1,165 @@
+"""Per-stream audio quality statistics for `server.py --analyze`, computed with NumPy.
+
+Each frame is decoded and measured with whole-array operations, so the cost
+per frame stays in the microseconds however many streams are running.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Statistics are taken over blocks of this many seconds; a block is silent
+# when its level is below `SILENCE_DBFS`.
+BLOCK_SECONDS = 0.02
+SILENCE_DBFS = -50.0
+
+# Thresholds above which the close summary calls out a likely capture problem
+CLIPPING_WARNING = 0.001
+DC_OFFSET_WARNING = 0.05
+SILENCE_WARNING = 0.95
+CORRELATION_WARNING = 0.99
+
+
+def mulaw_table():
+    """Returns the linear16 value of each of the 256 G.711 mu-law codes."""
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def dbfs(value):
+    return round(20 * float(np.log10(value)), 1) if value > 0 else None
+
+
+class AudioAnalyzer:
+    """Running level, clipping, DC offset, silence and correlation statistics for one stream.
+
+    `add()` takes frames as they arrive, in any size; bytes that don't make up
+    a whole block are carried over to the next frame. All sums are kept per
+    channel in float64, and the channels' cross products in a small matrix,
+    so memory use is fixed for the life of the stream.
+    """
+
+    MULAW = None
+
+    def __init__(self, encoding, sample_rate, channels):
+        self.encoding = encoding
+        self.channels = max(1, channels)
+        if encoding == "mulaw":
+            if AudioAnalyzer.MULAW is None:
+                AudioAnalyzer.MULAW = mulaw_table()
+            self.sample_width = 1
+            self.full_scale = float(np.abs(AudioAnalyzer.MULAW.astype(np.int32)).max())
+        else:
+            self.sample_width = 2
+            self.full_scale = 32767.0
+
+        block_frames = max(1, int(sample_rate * BLOCK_SECONDS))
+        self.block_bytes = block_frames * self.channels * self.sample_width
+        self.pending = b""
+
+        self.samples = 0
+        self.sums = np.zeros(self.channels)
+        self.cross = np.zeros((self.channels, self.channels))
+        self.peaks = np.zeros(self.channels)
+        self.clipped = np.zeros(self.channels, dtype=np.int64)
+        self.blocks = 0
+        self.silent_blocks = 0
+        self.silence_level = (10 ** (SILENCE_DBFS / 20)) ** 2
+
+    def add(self, data):
+        data = self.pending + data if self.pending else data
+        usable = len(data) - len(data) % self.block_bytes
+        self.pending = bytes(data[usable:])
+        if usable:
+            self._measure(memoryview(data)[:usable], self.block_bytes)
+
+    def close(self):
+        # measure what's left as one short block, dropping any partial frame
+        frame_bytes = self.channels * self.sample_width
+        usable = len(self.pending) - len(self.pending) % frame_bytes
+        if usable:
+            self._measure(self.pending[:usable], usable)
+        self.pending = b""
+
+    def _decode(self, data):
+        if self.encoding == "mulaw":
+            samples = AudioAnalyzer.MULAW[np.frombuffer(data, dtype=np.uint8)]
+        else:
+            samples = np.frombuffer(data, dtype="<i2")
+        return samples.reshape(-1, self.channels)
+
+    def _measure(self, data, block_bytes):
+        raw = self._decode(data)
+        samples = raw.astype(np.float64) / self.full_scale
+
+        self.samples += len(samples)
+        self.sums += samples.sum(axis=0)
+        # the diagonal is each channel's sum of squares
+        self.cross += samples.T @ samples
+        self.peaks = np.maximum(self.peaks, np.abs(samples).max(axis=0))
+        self.clipped += (np.abs(raw.astype(np.int32)) >= self.full_scale).sum(axis=0)
+
+        # the level of each block, across all channels
+        block_frames = block_bytes // (self.channels * self.sample_width)
+        levels = (samples.reshape(-1, block_frames, self.channels) ** 2).mean(axis=(1, 2))
+        self.blocks += len(levels)
+        self.silent_blocks += int((levels < self.silence_level).sum())
+
+    def summary(self):
+        """Returns the statistics so far, per channel where that applies."""
+        if not self.samples:
+            return {"samples": 0}
+
+        n = self.samples
+        means = self.sums / n
+        mean_squares = np.diag(self.cross) / n
+        stats = {
+            "samples": n,
+            "rms_dbfs": [dbfs(v) for v in np.sqrt(mean_squares)],
+            "peak_dbfs": [dbfs(v) for v in self.peaks],
+            "clipping_ratio": [round(float(v), 6) for v in self.clipped / n],
+            "dc_offset": [round(float(v), 6) for v in means],
+            "silence_fraction": round(self.silent_blocks / self.blocks, 4),
+        }
+
+        if self.channels > 1:
+            # Pearson correlation between every pair of channels
+            covariance = self.cross / n - np.outer(means, means)
+            deviations = np.sqrt(np.maximum(np.diag(covariance), 0))
+            scale = np.outer(deviations, deviations)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                correlation = np.where(scale > 0, covariance / scale, 0.0)
+            stats["channel_correlation"] = np.round(correlation, 4).tolist()
+        return stats
+
+    def problems(self):
+        """Returns a description of each likely capture problem."""
+        stats = self.summary()
+        if not stats["samples"]:
+            return []
+
+        problems = []
+        for channel in range(self.channels):
+            if stats["clipping_ratio"][channel] > CLIPPING_WARNING:
+                problems.append(
+                    f"channel {channel} is clipping ({stats['clipping_ratio'][channel]:.2%} of samples at full scale)"
+                )
+            if abs(stats["dc_offset"][channel]) > DC_OFFSET_WARNING:
+                problems.append(
+                    f"channel {channel} has a DC offset of {stats['dc_offset'][channel]:+.3f}"
+                )
+        if stats["silence_fraction"] > SILENCE_WARNING:
+            problems.append(
+                f"{stats['silence_fraction']:.0%} of the audio is below {SILENCE_DBFS:.0f} dBFS"
+            )
+        for i in range(self.channels):
+            for j in range(i + 1, self.channels):
+                if stats["channel_correlation"][i][j] > CORRELATION_WARNING:
+                    problems.append(
+                        f"channels {i} and {j} are nearly identical, so the input may be duplicated mono"
+                    )
+        return problems
@@ -0,0 +1,140 @@
+"""Microbenchmark of decoding Deepgram-shaped Results messages.
+
+Compares the receivers' old pattern (stdlib `json.loads`, then walking
+`res.get("channel", {}).get("alternatives", [{}])[0]` for each field) with
+`codec.decode()` on every JSON backend that is installed. The messages are
+the interim and final Results that `server.py --mock-asr` sends for a stream.
+
+    python benchmarks/codec_bench.py --messages 20000 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec  # noqa: E402
+from mock_asr import FINAL_INTERVAL, INTERIM_INTERVAL, mock_word, WORD_INTERVAL  # noqa: E402
+
+
+def record_messages(count):
+    """Returns `count` Results messages as they would arrive on the wire."""
+    messages = []
+    start = 0.0
+    while len(messages) < count:
+        # a few interim results, then the final one for each utterance
+        for end in (start + INTERIM_INTERVAL, start + 2 * INTERIM_INTERVAL, start + FINAL_INTERVAL):
+            first = int(start / WORD_INTERVAL + 0.5)
+            last = int(end / WORD_INTERVAL + 0.5)
+            words = [mock_word(index) for index in range(first, last)]
+            messages.append(
+                json.dumps(
+                    {
+                        "type": "Results",
+                        "channel_index": [0, 1],
+                        "duration": round(end - start, 3),
+                        "start": round(start, 3),
+                        "is_final": end == start + FINAL_INTERVAL,
+                        "speech_final": end == start + FINAL_INTERVAL,
+                        "channel": {
+                            "alternatives": [
+                                {
+                                    "transcript": " ".join(w["punctuated_word"] for w in words),
+                                    "confidence": 0.99,
+                                    "words": words,
+                                }
+                            ]
+                        },
+                        "metadata": {
+                            "request_id": "00000000-0000-0000-0000-000000000000",
+                            "model_info": {"name": "general", "version": "mock", "arch": "mock"},
+                            "model_uuid": "00000000-0000-0000-0000-000000000000",
+                        },
+                    }
+                )
+            )
+        start += FINAL_INTERVAL
+    return messages[:count]
+
+
+def stdlib_walk(messages):
+    # what the receivers did before codec.py
+    for msg in messages:
+        res = json.loads(msg)
+        if res.get("is_final"):
+            transcript = res.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "")
+            words = res.get("channel", {}).get("alternatives", [{}])[0].get("words", [])
+            start = res["start"]
+            end = res["start"] + res["duration"]
+            if words:
+                words[0]["start"], words[-1]["end"]
+        else:
+            res.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "")
+
+
+def struct_decode(loads):
+    def run(messages):
+        for msg in messages:
+            res = codec.Result(loads(msg))
+            if res.is_final:
+                transcript = res.transcript
+                start = res.start
+                end = res.end
+                if res.words:
+                    res.words[0].start, res.words[-1].end
+            else:
+                res.transcript
+
+    return run
+
+
+def backends():
+    candidates = {"json": json.loads}
+    try:
+        import orjson
+
+        candidates["orjson"] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import msgspec
+
+        candidates["msgspec"] = msgspec.json.Decoder().decode
+    except ImportError:
+        pass
+    return candidates
+
+
+def best_time(func, messages, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(messages)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks decoding of Results messages.")
+    parser.add_argument("--messages", help="How many messages to decode per run. Defaults to 20000.", default=20000, type=int)
+    parser.add_argument("--repeat", help="How many runs to take the best of. Defaults to 5.", default=5, type=int)
+    args = parser.parse_args()
+
+    messages = record_messages(args.messages)
+    size = sum(len(msg) for msg in messages) / len(messages)
+    print(f"ℹ️  {len(messages)} messages, {size:.0f} bytes on average, codec backend {codec.BACKEND}")
+
+    baseline = best_time(stdlib_walk, messages, args.repeat)
+    print(f"json + dict walk:    {len(messages) / baseline:>10.0f} msg/s")
+    for name, loads in backends().items():
+        elapsed = best_time(struct_decode(loads), messages, args.repeat)
+        print(
+            f"{name + ' + Result:':<20} {len(messages) / elapsed:>10.0f} msg/s ({baseline / elapsed:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""End-to-end benchmarks of the streaming pipeline against a local server.py.
+
+Starts `server.py` on a free port (recording into a temporary directory) and
+measures, for every combination of `--concurrency`, `--encodings` and
+`--chunk-seconds` (the `REALTIME_RESOLUTION` audio is sent in):
+
+- connection throughput: streams opened, closed with CloseStream and
+  answered per second
+- sustained real-time streaming: how many streams finish, and how far
+  their sends land behind schedule
+- server CPU time and RSS growth per stream, from /proc (Linux only)
+- sender chunking cost: reading (and for mulaw, encoding) one chunk
+- receiver parse cost: decoding one Results message with `codec.decode`
+- subtitle cue building: final results per second through
+  `SubtitleEngine.add()` and `flush()`, for SRT and VTT, with and without
+  splitting long cues
+
+Results are written as JSON with `--output`, and `--compare OLD NEW` lists
+the metrics that got worse by more than `--threshold`, exiting with an error
+if any did. Server CPU time is counted in clock ticks (usually 10ms), so a
+change of up to two ticks per stream is taken for noise, however large it is
+relative to a short run:
+
+    python benchmarks/pipeline_bench.py --concurrency 1,10,50 --output new.json
+    python benchmarks/pipeline_bench.py --compare old.json new.json --threshold 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import client  # noqa: E402
+import codec  # noqa: E402
+import websockets  # noqa: E402
+from codec_bench import record_messages  # noqa: E402
+from metrics import summarize  # noqa: E402
+from streaming import iter_chunks  # noqa: E402
+from subtitles import SubtitleEngine  # noqa: E402
+from transcode import linear16_to_mulaw, np  # noqa: E402
+
+# Whether a higher or lower value of each metric is better, for --compare
+HIGHER_IS_BETTER = {
+    "connections_per_second": True,
+    "completed_ratio": True,
+    "send_lag_p95_ms": False,
+    "send_lag_max_ms": False,
+    "server_cpu_ms_per_stream": False,
+    "server_rss_kb_per_stream": False,
+    "us_per_chunk": False,
+    "us_per_message": False,
+    "results_per_second": True,
+}
+
+# Metrics measured in coarse steps, and the metric recording the size of a
+# step; changes of up to `NOISE_STEPS` steps are never counted as regressions
+RESOLUTIONS = {"server_cpu_ms_per_stream": "server_cpu_resolution_ms"}
+NOISE_STEPS = 2
+
+# The longest subtitle cue, in characters, when cues are split
+SUBTITLE_MAX_CHARS = 42
+
+
+def write_inputs(directory, seconds, encodings):
+    """Writes `seconds` of preamble.wav as raw audio in each encoding.
+
+    Returns the sample rate, the path of the linear16 audio and {encoding: path}.
+    """
+    with wave.open(os.path.join(ROOT, "preamble.wav"), "rb") as fh:
+        assert fh.getsampwidth() == 2 and fh.getnchannels() == 1
+        sample_rate = fh.getframerate()
+        available = fh.readframes(fh.getnframes())
+    # loop the recording if more audio is asked for than it holds
+    needed = int(seconds * sample_rate) * 2
+    audio = (available * (needed // len(available) + 1))[:needed]
+
+    source = os.path.join(directory, "source.linear16")
+    with open(source, "wb") as f:
+        f.write(audio)
+
+    paths = {}
+    for encoding in encodings:
+        if encoding == "mulaw":
+            if np is None:
+                print("🟠 Skipping mulaw, which needs NumPy to encode")
+                continue
+            data = linear16_to_mulaw(np.frombuffer(audio, dtype="<i2")).tobytes()
+        else:
+            data = audio
+        paths[encoding] = os.path.join(directory, f"input.{encoding}")
+        with open(paths[encoding], "wb") as f:
+            f.write(data)
+    return sample_rate, source, paths
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port):
+    """Starts server.py in `directory` and waits until it accepts connections."""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port), "--quiet", "--ack", "summary"],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("server.py did not start listening within 10 seconds")
+
+
+class ProcessSampler:
+    """Samples a process's CPU time and resident memory from /proc while a benchmark runs."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self.peak_rss_kb = 0
+        self.task = None
+
+    def tick_seconds(self):
+        return 1 / os.sysconf("SC_CLK_TCK")
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            # utime and stime, after the parenthesized command name
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) * self.tick_seconds()
+
+    def rss_kb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+        return 0
+
+    async def _sample(self):
+        while True:
+            self.peak_rss_kb = max(self.peak_rss_kb, self.rss_kb())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if not self.available:
+            return
+        self.cpu_start = self.cpu_seconds()
+        self.rss_start = self.peak_rss_kb = self.rss_kb()
+        self.task = asyncio.ensure_future(self._sample())
+
+    def stop(self, streams):
+        """Returns the CPU time and memory growth per stream since `start()`."""
+        if not self.available:
+            return {}
+        self.task.cancel()
+        return {
+            "server_cpu_ms_per_stream": (self.cpu_seconds() - self.cpu_start) * 1000 / streams,
+            "server_rss_kb_per_stream": max(0, self.peak_rss_kb - self.rss_start) / streams,
+            "server_cpu_resolution_ms": self.tick_seconds() * 1000 / streams,
+        }
+
+
+async def connection_throughput(url, encoding, sample_rate, concurrency, connections):
+    """Opens `connections` streams, `concurrency` at a time, each closed right away."""
+    url += f"?encoding={encoding}&sample_rate={sample_rate}&channels=1"
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def connect():
+        nonlocal errors
+        async with semaphore:
+            try:
+                async with websockets.connect(url) as ws:
+                    await ws.send(codec.dumps({"type": "CloseStream"}))
+                    # the server hangs up once it has answered
+                    async for _ in ws:
+                        pass
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect() for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    return {"connections_per_second": connections / elapsed, "errors": errors}
+
+
+async def sustained_streams(url, path, encoding, sample_rate, concurrency, sampler):
+    """Streams `path` over `concurrency` connections at once, at real time."""
+    results = []
+
+    async def stream():
+        stats = client.StreamStats()
+        try:
+            await client.audio_stream(path, encoding, sample_rate, 1, url=url, stats=stats, verbose=False)
+        except Exception as e:
+            stats.error = type(e).__name__
+        results.append(stats)
+
+    sampler.start()
+    await asyncio.gather(*(stream() for _ in range(concurrency)))
+    metrics = sampler.stop(concurrency)
+
+    lags = [lag for stats in results for lag in stats.send_lag]
+    summary = summarize(lags)
+    completed = sum(1 for stats in results if stats.final_message and not stats.error)
+    metrics.update(
+        completed_ratio=completed / concurrency,
+        send_lag_p95_ms=summary["p95"] * 1000 if lags else 0.0,
+        send_lag_max_ms=summary["max"] * 1000 if lags else 0.0,
+    )
+    return metrics
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def chunking_cost(path, encoding, sample_rate, chunk_seconds, repeat):
+    """Reads a linear16 file chunk by chunk, encoding each chunk as `encoding`."""
+    chunk_size = int(2 * sample_rate * chunk_seconds)
+    chunk_size -= chunk_size % 2
+    chunks = -(-os.path.getsize(path) // chunk_size)
+
+    def send_all():
+        for chunk in iter_chunks(path, chunk_size):
+            if encoding == "mulaw":
+                linear16_to_mulaw(np.frombuffer(chunk, dtype="<i2")).tobytes()
+            else:
+                bytes(chunk)
+
+    return {"us_per_chunk": best_time(send_all, repeat) * 1e6 / chunks}
+
+
+def parse_cost(messages, repeat):
+    def decode_all():
+        for msg in messages:
+            res = codec.decode(msg)
+            if res.is_final:
+                res.words
+
+    return {"us_per_message": best_time(decode_all, repeat) * 1e6 / len(messages)}
+
+
+def subtitle_throughput(messages, format, max_chars, repeat):
+    """Builds the cues of every final result in `messages` with a fresh `SubtitleEngine`."""
+    finals = [res for res in map(codec.decode, messages) if res.is_final]
+    for res in finals:
+        # decode the words up front, so only cue building is timed
+        res.words
+
+    def build_all():
+        engine = SubtitleEngine(format, max_chars=max_chars)
+        for res in finals:
+            engine.add(res)
+        engine.flush()
+
+    return {"results_per_second": len(finals) / best_time(build_all, repeat)}
+
+
+def run_benchmarks(args):
+    concurrencies = [int(value) for value in args.concurrency.split(",")]
+    encodings = args.encodings.split(",")
+    chunk_durations = [float(value) for value in args.chunk_seconds.split(",")]
+    results = []
+
+    def record(benchmark, params, metrics):
+        results.append({"benchmark": benchmark, "params": params, "metrics": metrics})
+        shown = ", ".join(f"{name} {value:.4g}" for name, value in metrics.items())
+        print(f"{benchmark} {json.dumps(params)}: {shown}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        sample_rate, source, inputs = write_inputs(directory, args.seconds, encodings)
+
+        # in-process costs, without the server
+        for chunk_seconds in chunk_durations:
+            for encoding in inputs:
+                record(
+                    "sender_chunking",
+                    {"encoding": encoding, "chunk_seconds": chunk_seconds},
+                    chunking_cost(source, encoding, sample_rate, chunk_seconds, args.repeat),
+                )
+        messages = record_messages(args.messages)
+        record("receiver_parse", {"backend": codec.BACKEND}, parse_cost(messages, args.repeat))
+        for format in ("srt", "vtt"):
+            for max_chars in (0, SUBTITLE_MAX_CHARS):
+                record(
+                    "subtitle_engine",
+                    {"format": format, "max_chars": max_chars},
+                    subtitle_throughput(messages, format, max_chars, args.repeat),
+                )
+
+        port = free_port()
+        url = f"ws://localhost:{port}"
+        server = start_server(directory, port)
+        try:
+            sampler = ProcessSampler(server.pid)
+            for encoding in inputs:
+                for concurrency in concurrencies:
+                    record(
+                        "connection_throughput",
+                        {"encoding": encoding, "concurrency": concurrency},
+                        asyncio.run(connection_throughput(url, encoding, sample_rate, concurrency, max(args.connections, concurrency))),
+                    )
+                    for chunk_seconds in chunk_durations:
+                        # the client sends audio in chunks of this many seconds
+                        client.REALTIME_RESOLUTION = chunk_seconds
+                        record(
+                            "sustained_streams",
+                            {"encoding": encoding, "concurrency": concurrency, "chunk_seconds": chunk_seconds},
+                            asyncio.run(sustained_streams(url, inputs[encoding], encoding, sample_rate, concurrency, sampler)),
+                        )
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "codec_backend": codec.BACKEND,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(old_path, new_path, threshold):
+    """Prints how every metric changed between two runs; returns the regressions."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def key(result):
+        return result["benchmark"], json.dumps(result["params"], sort_keys=True)
+
+    baseline = {key(result): result["metrics"] for result in old["results"]}
+    regressions = []
+    for result in new["results"]:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        for name, value in result["metrics"].items():
+            if name not in HIGHER_IS_BETTER or not before.get(name):
+                continue
+            change = (value - before[name]) / abs(before[name])
+            worse = -change if HIGHER_IS_BETTER[name] else change
+            noise = False
+            if name in RESOLUTIONS:
+                step = max(result["metrics"].get(RESOLUTIONS[name], 0), before.get(RESOLUTIONS[name], 0))
+                noise = abs(value - before[name]) <= NOISE_STEPS * step
+            if noise:
+                worse = 0
+            flag = "🔴" if worse > threshold else "🟢"
+            print(
+                f"{flag} {result['benchmark']} {key(result)[1]} {name}: {before[name]:.4g} -> {value:.4g} ({change:+.1%})"
+                + (", within measurement noise" if noise else "")
+            )
+            if worse > threshold:
+                regressions.append((key(result), name))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the streaming pipeline against a local server.py.")
+    parser.add_argument("--concurrency", help="Comma-separated numbers of concurrent streams. Defaults to 1,10.", default="1,10")
+    parser.add_argument("--encodings", help='Comma-separated encodings to stream ("linear16", "mulaw"). Defaults to linear16,mulaw.', default="linear16,mulaw")
+    parser.add_argument("--chunk-seconds", help="Comma-separated chunk durations in seconds. Defaults to 0.1,0.25.", default="0.1,0.25")
+    parser.add_argument("--seconds", help="How many seconds of audio each sustained stream sends. Defaults to 5.", default=5.0, type=float)
+    parser.add_argument("--connections", help="How many connections the throughput benchmark opens. Defaults to 200.", default=200, type=int)
+    parser.add_argument("--messages", help="How many Results messages the parse and subtitle benchmarks go through. Defaults to 20000.", default=20000, type=int)
+    parser.add_argument("--repeat", help="How many runs of the in-process benchmarks to take the best of. Defaults to 5.", default=5, type=int)
+    parser.add_argument("--output", help="Write the results to this JSON file.", default=None)
+    parser.add_argument("--compare", help="Compare two results files instead of running the benchmarks.", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", help="With --compare, the relative change that counts as a regression. Defaults to 0.1.", default=0.1, type=float)
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold)
+        print(f"{'🔴' if regressions else '🟢'} {len(regressions)} regression(s) above {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"🟢 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,90 @@
+"""Startup-time benchmark for the streaming scripts, based on `python -X importtime`.
+
+Imports a script's module in a fresh interpreter a few times and reports the
+best total import time and the slowest modules it pulled in. It exits with
+an error if a module that should only be loaded on first use (by default
+PyAudio and aiohttp, which test_suite.py only needs for the microphone and
+URL inputs, and NumPy, which it only needs for --vad and transcoding) was
+imported, or if the import took longer than `--max-ms`, so it
+can guard against regressions:
+
+    python benchmarks/startup_bench.py --module test_suite --max-ms 150
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """Returns {module name: (self µs, cumulative µs)} for one import of `module`."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode:
+        raise RuntimeError(f"importing {module} failed:\n{completed.stderr}")
+
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        if not self_time.strip().isdigit():
+            # the header line
+            continue
+        times[name.strip()] = (int(self_time), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how long a script takes to import.")
+    parser.add_argument("--module", help="Which module to import. Defaults to test_suite.", default="test_suite")
+    parser.add_argument("--runs", help="How many fresh interpreters to take the best of. Defaults to 5.", default=5, type=int)
+    parser.add_argument("--top", help="How many of the slowest modules to list. Defaults to 10.", default=10, type=int)
+    parser.add_argument(
+        "--forbid",
+        help="Comma-separated modules that must not be imported at startup. Defaults to pyaudio,aiohttp,numpy.",
+        default="pyaudio,aiohttp,numpy",
+    )
+    parser.add_argument("--max-ms", help="Fail if the best import time is above this many milliseconds.", default=None, type=float)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(max(1, args.runs))]
+    best = min(runs, key=lambda times: times[args.module][1])
+    total_ms = best[args.module][1] / 1000
+    print(f"ℹ️  import {args.module}: {total_ms:.1f}ms (best of {len(runs)}), {len(best)} modules")
+
+    # the modules that cost the most including what they imported, skipping
+    # any whose parent package is already listed
+    listed = []
+    for name, (_, cumulative) in sorted(best.items(), key=lambda item: -item[1][1]):
+        if name == args.module or any(name.startswith(parent + ".") for parent in listed):
+            continue
+        listed.append(name)
+        print(f"    {cumulative / 1000:8.1f}ms  {name}")
+        if len(listed) == args.top:
+            break
+
+    failures = []
+    forbidden = [name for name in args.forbid.split(",") if name]
+    loaded = sorted(name for name in best if name.split(".")[0] in forbidden)
+    if loaded:
+        failures.append(f"imported at startup: {', '.join(loaded)}")
+    if args.max_ms is not None and total_ms > args.max_ms:
+        failures.append(f"took {total_ms:.1f}ms, more than the {args.max_ms:.1f}ms allowed")
+
+    for failure in failures:
+        print(f"🔴 {failure}")
+    if failures:
+        sys.exit(1)
+    print("🟢 Startup is within bounds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Hands microphone audio from PortAudio's callback thread to the event loop."""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+# How many capture-to-send latency samples to keep for reporting
+LATENCY_SAMPLES = 10000
+
+
+class RingBuffer:
+    """A fixed-size, thread-safe buffer of audio chunks.
+
+    All memory is allocated up front: `slots` chunks of up to `slot_size`
+    bytes each. The capture thread calls `push()`, which never blocks on the
+    event loop or allocates. When every slot is full the oldest chunk is
+    overwritten, so a stalled sender costs audio rather than memory; each
+    overwritten chunk is counted in `dropped`. The event loop awaits `get()`.
+    """
+
+    def __init__(self, slots, slot_size, loop):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.storage = bytearray(slots * slot_size)
+        self.view = memoryview(self.storage)
+        self.lengths = [0] * slots
+        self.captured_at = [0.0] * slots
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+        self.loop = loop
+        self.ready = asyncio.Event()
+        self.closed = False
+
+        self.pushed = 0
+        self.dropped = 0
+        self.truncated = 0
+        # set by the capture callback when the device itself lost audio
+        self.input_overflows = 0
+        self.max_depth = 0
+        # the most recent capture-to-send latencies, bounded for long sessions
+        self.send_latency = deque(maxlen=LATENCY_SAMPLES)
+
+    def push(self, data):
+        """Adds a chunk. Called from the capture thread."""
+        captured_at = time.monotonic()
+        size = len(data)
+        if size > self.slot_size:
+            self.truncated += 1
+            size = self.slot_size
+
+        with self.lock:
+            if self.count == self.slots:
+                # overwrite the oldest chunk
+                self.head = (self.head + 1) % self.slots
+                self.count -= 1
+                self.dropped += 1
+            slot = (self.head + self.count) % self.slots
+            start = slot * self.slot_size
+            self.view[start : start + size] = memoryview(data)[:size]
+            self.lengths[slot] = size
+            self.captured_at[slot] = captured_at
+            self.count += 1
+            self.pushed += 1
+            self.max_depth = max(self.max_depth, self.count)
+            # the consumer only needs waking when the buffer was empty
+            wake = self.count == 1
+
+        if wake:
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    def close(self):
+        """Wakes the consumer once the remaining chunks have been read. Thread-safe."""
+        with self.lock:
+            self.closed = True
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def get(self):
+        """Returns the oldest chunk and when it was captured, or (None, None) once closed."""
+        while True:
+            with self.lock:
+                if self.count:
+                    slot = self.head
+                    start = slot * self.slot_size
+                    data = bytes(self.view[start : start + self.lengths[slot]])
+                    captured_at = self.captured_at[slot]
+                    self.head = (self.head + 1) % self.slots
+                    self.count -= 1
+                    return data, captured_at
+                if self.closed:
+                    return None, None
+                self.ready.clear()
+            await self.ready.wait()
+
+    def sent(self, captured_at):
+        """Records that a chunk captured at `captured_at` has been sent."""
+        self.send_latency.append(time.monotonic() - captured_at)
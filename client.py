@@ -1,9 +1,16 @@
 import argparse
 import asyncio
+import multiprocessing
 import os
 import sys
+import time
 import websockets
-import json
+from collections import Counter
+
+import codec
+from metrics import format_summary
+from streaming import Pacer, iter_chunks, validate_speed
+from tracing import CLIENT, NOOP_SPAN, open_tracer
 
 # Mimic sending a real-time stream by sending this many seconds of audio at a time.
 # Used for file "streaming" only.
@@ -12,27 +19,78 @@ REALTIME_RESOLUTION = 0.250
 encoding_samplewidth_map = {"linear16": 2, "mulaw": 1}
 
 
-async def audio_stream(audio_file_path, encoding, sample_rate, channels):
-    data = open(audio_file_path, "rb").read()
+class StreamStats:
+    """Timings for one stream, taken with a monotonic clock."""
+
+    def __init__(self):
+        self.connect_start = None
+        self.connected = None
+        self.first_message = None
+        self.send_start = None
+        self.close_sent = None
+        self.final_message = None
+        self.bytes_sent = 0
+        self.target_byte_rate = None
+        self.send_lag = []
+        self.error = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def quiet(*args, **kwargs):
+    pass
 
-    url = "ws://localhost:5000"
-    # To test integrating with DG, uncomment the following line (also, specify your API key below)
-    # url = 'wss://api.deepgram.com/v1/listen'
 
+async def audio_stream(
+    audio_file_path,
+    encoding,
+    sample_rate,
+    channels,
+    url="ws://localhost:5000",
+    stats=None,
+    verbose=True,
+    speed=1.0,
+    burst=0.0,
+    span=NOOP_SPAN,
+    vad=None,
+):
+    log = print if verbose else quiet
+    stats = stats or StreamStats()
+
+    # With `vad` (keyword arguments for a `vad.SilenceGate`), silence is
+    # held back and KeepAlive messages sent instead
+    gate = None
+    if vad:
+        if encoding == "linear16":
+            from vad import SilenceGate
+
+            gate = SilenceGate(2 * sample_rate * channels, 2 * channels, **vad)
+        else:
+            log("🟠 The silence gate only works with linear16 audio, so it is disabled")
+
+    # To test integrating with DG, pass --url wss://api.deepgram.com/v1/listen
+    # (also, specify your API key below)
     url += f"?encoding={encoding}&sample_rate={sample_rate}&channels={channels}"
 
-    async with websockets.connect(
-        url,
-        extra_headers={
-            # If you're testing integration with DG, add your API key here
-            "Authorization": "Token {}".format("YOUR_DG_API_KEY")
-        },
-    ) as ws:
-        print("🟢 (1/5) Successfully opened streaming connection")
+    headers = {
+        # If you're testing integration with DG, add your API key here
+        "Authorization": "Token {}".format("YOUR_DG_API_KEY")
+    }
+    if span.recording:
+        # lets server.py --trace join its span to ours
+        headers["traceparent"] = span.traceparent()
+
+    stats.connect_start = time.perf_counter()
+    # the span also ends, with the error, if connecting fails
+    with span.child("connect", kind=CLIENT, url=url):
+        ws = await websockets.connect(url, extra_headers=headers)
+    try:
+        stats.connected = time.perf_counter()
+        log("🟢 (1/5) Successfully opened streaming connection")
 
         async def sender(ws):
-            print(f"🟢 (2/5) Ready to stream data")
-            nonlocal data
+            log(f"🟢 (2/5) Ready to stream data")
 
             # For audio formats with non-variable sample widths,
             # we can do some calculations and send audio in real-time
@@ -42,50 +100,89 @@ async def audio_stream(audio_file_path, encoding, sample_rate, channels):
                 byte_rate = sample_width * sample_rate * channels
                 # How many bytes are in `REALTIME_RESOLUTION` seconds of audio?
                 chunk_size = int(byte_rate * REALTIME_RESOLUTION)
+                # in whole frames, which the silence gate needs
+                chunk_size -= chunk_size % (sample_width * channels)
+                stats.target_byte_rate = byte_rate
             # Otherwise, we'll send an arbitrary chunk size
             else:
                 chunk_size = 5000
 
-            while len(data):
-                chunk, data = data[:chunk_size], data[chunk_size:]
-                # Mimic real-time by waiting `REALTIME_RESOLUTION` seconds
-                # before the next packet.
-                await asyncio.sleep(REALTIME_RESOLUTION)
+            async def send_audio(data):
+                # only audio that actually goes out counts towards the send rate
+                await ws.send(data)
+                if not stats.bytes_sent:
+                    span.event("first_byte_sent")
+                stats.bytes_sent += len(data)
+
+            pacer = Pacer(speed, burst, span)
+            stats.send_start = time.perf_counter()
+            for chunk in iter_chunks(audio_file_path, chunk_size):
+                # Mimic real-time by waiting until the audio in this packet
+                # would have been spoken. Without a fixed bitrate, treat
+                # every packet as `REALTIME_RESOLUTION` seconds of audio.
+                await pacer.wait(
+                    len(chunk) / byte_rate if sample_width else REALTIME_RESOLUTION
+                )
                 # Send the data
-                await ws.send(chunk)
+                if gate:
+                    await gate.send(chunk, send_audio, ws.send)
+                else:
+                    await send_audio(chunk)
 
-            await ws.send(json.dumps({"type": "CloseStream"}))
-            print(
+            await ws.send(codec.dumps({"type": "CloseStream"}))
+            stats.close_sent = time.perf_counter()
+            span.event("close_stream_sent")
+            stats.send_lag = list(pacer.lateness)
+            if stats.send_lag:
+                log(format_summary("Send lag behind schedule", stats.send_lag))
+            if gate:
+                log(f"ℹ️  Silence gate: {gate.report()}")
+            log(
                 "🟢 (4/5) Successfully closed connection, waiting for final messages if necessary"
             )
             return
 
         async def receiver(ws):
             first_message = True
+            first_final = True
             async for msg in ws:
                 if first_message:
-                    print("🟢 (3/5) Successfully receiving server messages")
+                    stats.first_message = time.perf_counter()
+                    span.event("first_message")
+                    log("🟢 (3/5) Successfully receiving server messages")
                     first_message = False
 
-                res = json.loads(msg)
+                res = codec.decode(msg)
                 # handle DG transcriptions, if we're streaming to DG instead of locally
-                transcript = (
-                    res.get("channel", {})
-                    .get("alternatives", [{}])[0]
-                    .get("transcript", "")
-                )
+                if isinstance(res, codec.Result):
+                    if first_final and res.is_final and res.transcript:
+                        span.event("first_final_transcript")
+                        first_final = False
+                    if res.transcript:
+                        log(f"DG transcript: {res.transcript}")
+                    continue
 
                 # handle local server messages, if we're streaming to our local server
                 if res.get("msg"):
-                    print(f"Server message: {res.get('msg')}")
-                elif transcript:
-                    print(f"DG transcript: {transcript}")
+                    log(f"Server message: {res.get('msg')}")
+                if res.get("audio_stats"):
+                    log(f"Server audio stats: {res.get('audio_stats')}")
+
+                # the local server's filename, or DG's closing metadata,
+                # is the last message that matters for a stream
+                if (res.get("filename") or res.get("created")) and not stats.final_message:
+                    stats.final_message = time.perf_counter()
+                    span.event("final_metadata")
 
-                if res.get("filename"):
+                if res.get("filename", "").endswith("index.json"):
+                    log(
+                        f"🟢 (5/5) Sent audio data was stored in segments under {os.path.dirname(res.get('filename'))}"
+                    )
+                elif res.get("filename"):
                     raw_filename = f"{res.get('filename').split('.')[0]}.raw"
-                    print(f"🟢 (5/5) Sent audio data was stored in {raw_filename}")
+                    log(f"🟢 (5/5) Sent audio data was stored in {raw_filename}")
                     if res.get("filename").split(".")[1] != "raw":
-                        print(
+                        log(
                             f"🟢 (5/5) Sent audio data was also containerized and saved in {res.get('filename')}"
                         )
 
@@ -96,6 +193,118 @@ async def audio_stream(audio_file_path, encoding, sample_rate, channels):
             asyncio.ensure_future(receiver(ws)),
         ]
         await asyncio.gather(*functions)
+    finally:
+        await ws.close()
+
+    return stats
+
+
+async def load_stream(index, streams, ramp, args, tracer):
+    """Runs one stream of a load test, starting it at its place in the ramp."""
+    stats = StreamStats()
+    if ramp and streams > 1:
+        await asyncio.sleep(ramp * index / (streams - 1))
+    span = tracer.span("stream", kind=CLIENT, input=args.input, stream=index)
+    try:
+        await audio_stream(
+            args.input,
+            args.encoding.lower(),
+            int(args.sample_rate),
+            int(args.channels),
+            url=args.url,
+            stats=stats,
+            verbose=False,
+            speed=args.speed,
+            burst=args.burst,
+            span=span,
+            vad=vad_options(args),
+        )
+    except Exception as e:
+        stats.error = type(e).__name__
+        span.end(e)
+    else:
+        span.end()
+    return stats.as_dict()
+
+
+async def run_load(indexes, streams, ramp, args, tracer):
+    return await asyncio.gather(
+        *(load_stream(index, streams, ramp, args, tracer) for index in indexes)
+    )
+
+
+def load_worker(indexes, streams, ramp, args):
+    # every process appends its own spans to the trace file
+    tracer = open_tracer(args.trace, "client")
+    try:
+        return asyncio.run(run_load(indexes, streams, ramp, args, tracer))
+    finally:
+        tracer.close()
+
+
+def load_test(args):
+    """Runs `args.streams` concurrent streams and prints latency and rate statistics."""
+    streams, ramp, processes = args.streams, args.ramp, max(1, args.processes)
+    print(
+        f"🟢 Starting {streams} stream(s) across {processes} process(es)"
+        + (f", ramping up over {ramp} seconds" if ramp else "")
+    )
+
+    if processes == 1:
+        results = load_worker(range(streams), streams, ramp, args)
+    else:
+        # deal the streams out round-robin so every process ramps up together
+        shares = [range(p, streams, processes) for p in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            results = [
+                stats
+                for share in pool.starmap(
+                    load_worker, [(share, streams, ramp, args) for share in shares]
+                )
+                for stats in share
+            ]
+
+    report_load(results)
+
+
+def report_load(results):
+    def elapsed(start, end):
+        return [r[end] - r[start] for r in results if r[start] and r[end]]
+
+    errors = Counter(r["error"] for r in results if r["error"])
+    completed = sum(1 for r in results if r["final_message"] and not r["error"])
+    print(f"🟢 {len(results)} stream(s) started, {completed} completed, {sum(errors.values())} failed")
+    for error, count in errors.most_common():
+        print(f"🔴 {error}: {count}")
+
+    print(format_summary("Connect time", elapsed("connect_start", "connected")))
+    print(format_summary("First message", elapsed("connected", "first_message")))
+    print(format_summary("Close to final", elapsed("close_sent", "final_message")))
+    print(
+        format_summary(
+            "Send lag behind schedule", [lag for r in results for lag in r["send_lag"]]
+        )
+    )
+
+    # how fast each stream was actually sent, relative to real time
+    rates = [
+        r["bytes_sent"] / (r["close_sent"] - r["send_start"]) / r["target_byte_rate"]
+        for r in results
+        if r["target_byte_rate"] and r["send_start"] and r["close_sent"]
+    ]
+    print(format_summary("Send rate", rates, unit="x", scale=1, digits=2))
+
+
+def vad_options(args):
+    """Returns the `vad.SilenceGate` options for `args`, or None without --vad."""
+    if not args.vad:
+        return None
+    return {
+        "threshold": args.vad_threshold,
+        "hangover": args.vad_hangover,
+        "preroll": args.vad_preroll,
+        "keepalive": args.keepalive_interval,
+    }
 
 
 def validate_input(input):
@@ -147,6 +356,77 @@ def parse_args():
         help="The number of channels in the raw audio file.",
         default=1,
     )
+    parser.add_argument(
+        "--speed",
+        help='How fast to stream the file relative to real time, e.g. 1, 2 or 10, or "max" to send it as fast as possible. Defaults to 1.',
+        default=1.0,
+        type=validate_speed,
+    )
+    parser.add_argument(
+        "--burst",
+        help="Send this many seconds of audio immediately on connecting, before pacing the rest. Defaults to 0.",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-u",
+        "--url",
+        help='The server to stream to. Defaults to the local server at "ws://localhost:5000".',
+        default="ws://localhost:5000",
+    )
+    parser.add_argument(
+        "-n",
+        "--streams",
+        help="Run a load test with this many concurrent streams of the input file, and print latency statistics instead of server messages. Defaults to 1, a single verbose stream.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--ramp",
+        help="With --streams, spread the start of the streams evenly over this many seconds. Defaults to 0, starting them all at once.",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--processes",
+        help="With --streams, split the streams across this many processes. Defaults to 1.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--vad",
+        help="Hold back silent audio instead of sending it, with KeepAlive messages to keep the connection open. Works with linear16 audio, and requires NumPy.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--vad-threshold",
+        help="With --vad, the level in dBFS below which audio counts as silence. Defaults to -45.",
+        default=-45.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--vad-hangover",
+        help="With --vad, how many seconds to keep sending after speech stops. Defaults to 0.5.",
+        default=0.5,
+        type=float,
+    )
+    parser.add_argument(
+        "--vad-preroll",
+        help="With --vad, how many seconds of audio from before speech starts to send along with it. Defaults to 0.25.",
+        default=0.25,
+        type=float,
+    )
+    parser.add_argument(
+        "--keepalive-interval",
+        help="With --vad, how many seconds apart to send KeepAlive messages while audio is held back. Defaults to 5.",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--trace",
+        help="Append a timeline of each stream (connecting, first audio sent, first message, CloseStream, final message and the send lag of every chunk) to this file as OpenTelemetry-shaped JSON lines. See tracing.py.",
+        default=None,
+    )
     return parser.parse_args()
 
 
@@ -158,12 +438,29 @@ def main():
     sample_rate = int(args.sample_rate)
     channels = int(args.channels)
 
+    if args.streams > 1:
+        return load_test(args)
+
+    tracer = open_tracer(args.trace, "client")
     try:
-        asyncio.get_event_loop().run_until_complete(
-            audio_stream(input, encoding, sample_rate, channels)
-        )
+        with tracer.span("stream", kind=CLIENT, input=input) as span:
+            asyncio.get_event_loop().run_until_complete(
+                audio_stream(
+                    input,
+                    encoding,
+                    sample_rate,
+                    channels,
+                    url=args.url,
+                    speed=args.speed,
+                    burst=args.burst,
+                    span=span,
+                    vad=vad_options(args),
+                )
+            )
     except websockets.exceptions.InvalidStatusCode as e:
         print(f"🔴 ERROR: Could not connect to server! {e}")
+    finally:
+        tracer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+"""Fast JSON for the streaming message hot path.
+
+Uses orjson (listed in requirements.txt), or msgspec, when installed and the
+standard library otherwise. The standard library is only a fallback: building
+`Result`s makes it somewhat slower than plain `json.loads` and a dict walk.
+Results messages are decoded into small slot-based objects so receivers read
+attributes instead of walking nested dicts on every message.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson:
+    BACKEND = "orjson"
+
+    def dumps(obj):
+        """Encodes `obj` as a JSON string, to be sent as a text frame."""
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+
+elif msgspec:
+    BACKEND = "msgspec"
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj):
+        """Encodes `obj` as a JSON string, to be sent as a text frame."""
+        return _encoder.encode(obj).decode()
+
+    loads = _decoder.decode
+
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj):
+        """Encodes `obj` as a JSON string, to be sent as a text frame."""
+        return _encoder.encode(obj)
+
+    loads = json.loads
+
+
+class Word:
+    __slots__ = ("word", "punctuated_word", "start", "end", "confidence")
+
+    def __init__(self, word, punctuated_word, start, end, confidence):
+        self.word = word
+        self.punctuated_word = punctuated_word
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+
+
+class Result:
+    """The parts of a Results message the scripts use, from its first alternative."""
+
+    __slots__ = (
+        "start",
+        "duration",
+        "is_final",
+        "speech_final",
+        "channel_index",
+        "transcript",
+        "confidence",
+        "_words",
+        "_raw_words",
+    )
+
+    def __init__(self, message):
+        self.start = message["start"]
+        self.duration = message["duration"]
+        self.is_final = message.get("is_final", False)
+        self.speech_final = message.get("speech_final", False)
+        self.channel_index = message.get("channel_index")
+
+        alternatives = message.get("channel", {}).get("alternatives")
+        alternative = alternatives[0] if alternatives else {}
+        self.transcript = alternative.get("transcript", "")
+        self.confidence = alternative.get("confidence", 0.0)
+        # most messages are interim results whose words are never looked at,
+        # so `Word`s are only built when asked for
+        self._raw_words = alternative.get("words", ())
+        self._words = None
+
+    @property
+    def words(self):
+        if self._words is None:
+            self._words = [
+                Word(
+                    word["word"],
+                    word.get("punctuated_word", word["word"]),
+                    word["start"],
+                    word["end"],
+                    word.get("confidence", 0.0),
+                )
+                for word in self._raw_words
+            ]
+            self._raw_words = ()
+        return self._words
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def __repr__(self):
+        return f"Result({self.start:.2f}s-{self.end:.2f}s, final={self.is_final}, {self.transcript!r})"
+
+
+def decode(data):
+    """Decodes a server message: a `Result` for Results messages, otherwise a dict."""
+    message = loads(data)
+    if message.get("type") == "Results" or (
+        "channel" in message and "start" in message
+    ):
+        return Result(message)
+    return message
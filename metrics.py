@@ -0,0 +1,87 @@
+"""Helpers for summarizing latency samples collected by the streaming scripts."""
+
+import json
+import time
+from collections import deque
+
+
+def percentile(values, p):
+    """Returns the `p`th percentile (0-100) of `values`, interpolating between samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(values):
+    """Returns count, mean, p50/p95/p99 and max of `values` as a dict."""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def format_summary(label, values, unit="ms", scale=1000, digits=1):
+    """Formats a one-line summary of `values` (in seconds, shown in `unit`)."""
+    summary = summarize(values)
+    if not summary["count"]:
+        return f"{label}: no samples"
+    return (
+        f"{label}: p50 {summary['p50'] * scale:.{digits}f}{unit}, "
+        f"p95 {summary['p95'] * scale:.{digits}f}{unit}, "
+        f"p99 {summary['p99'] * scale:.{digits}f}{unit}, "
+        f"max {summary['max'] * scale:.{digits}f}{unit} "
+        f"({summary['count']} samples)"
+    )
+
+
+class LatencyTracker:
+    """Measures how long after audio is sent its final transcript arrives.
+
+    The sender calls `sent()` with the stream offset (in seconds) at the end
+    of each chunk it sends. The receiver calls `finalized()` with the end
+    offset (`start + duration`) of each final result, which is matched to the
+    chunk containing that offset. Chunks older than the latest final are
+    dropped, so memory stays bounded however long the stream runs.
+    """
+
+    def __init__(self):
+        self.sends = deque()
+        self.latencies = []
+        self.utterances = []
+
+    def sent(self, audio_end):
+        self.sends.append((audio_end, time.monotonic()))
+
+    def finalized(self, start, end, transcript=""):
+        """Records a final result and returns its latency in seconds, if known."""
+        received_at = time.monotonic()
+        # keep the first chunk that reaches `end`; finals only move forward
+        while len(self.sends) > 1 and self.sends[0][0] < end:
+            self.sends.popleft()
+        if not self.sends:
+            return None
+
+        latency = received_at - self.sends[0][1]
+        self.latencies.append(latency)
+        self.utterances.append(
+            {"start": start, "end": end, "latency": latency, "transcript": transcript}
+        )
+        return latency
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(
+                {"summary": summarize(self.latencies), "utterances": self.utterances},
+                f,
+                indent=2,
+            )
@@ -0,0 +1,194 @@
+"""Offline stand-in for Deepgram's streaming responses, used by `server.py --mock-asr`.
+
+The mock never looks at the audio itself. It "recognizes" a fixed text at a
+steady speaking rate, so the word timings, interim/final results and the
+closing metadata message all line up with how much audio has been received.
+"""
+
+import asyncio
+import hashlib
+import math
+import random
+import uuid
+from datetime import datetime, timezone
+
+import codec
+
+MOCK_TEXT = (
+    "We the people of the United States, in order to form a more perfect union, "
+    "establish justice, insure domestic tranquility, provide for the common defense, "
+    "promote the general welfare, and secure the blessings of liberty to ourselves "
+    "and our posterity, do ordain and establish this Constitution for the United "
+    "States of America."
+).split()
+
+# The mock speaker says a word every `WORD_INTERVAL` seconds,
+# and each word takes `WORD_LENGTH` seconds to say.
+WORD_INTERVAL = 0.4
+WORD_LENGTH = 0.3
+
+# How much new audio triggers an interim result, and how long an utterance
+# runs before it is finalized.
+INTERIM_INTERVAL = 1.0
+FINAL_INTERVAL = 3.0
+
+
+class MockLatency:
+    """How long the mock takes to respond to a piece of audio.
+
+    The delay is `fixed` milliseconds, plus or minus up to `jitter`
+    milliseconds, plus `per_session` milliseconds for every other stream the
+    server is handling at the time.
+    """
+
+    def __init__(self, fixed=0.0, jitter=0.0, per_session=0.0):
+        self.fixed = fixed
+        self.jitter = jitter
+        self.per_session = per_session
+
+    def delay(self, active_sessions=1):
+        delay = self.fixed + self.per_session * max(0, active_sessions - 1)
+        if self.jitter:
+            delay += random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay) / 1000
+
+
+def mock_word(index):
+    punctuated_word = MOCK_TEXT[index % len(MOCK_TEXT)]
+    start = index * WORD_INTERVAL
+    return {
+        "word": punctuated_word.strip(",.").lower(),
+        "start": round(start, 3),
+        "end": round(start + WORD_LENGTH, 3),
+        "confidence": 0.99,
+        "punctuated_word": punctuated_word,
+    }
+
+
+class MockTranscriber:
+    """Produces Deepgram-shaped Results for one stream.
+
+    Call `audio()` with the total duration received so far as audio arrives,
+    and `finish()` on CloseStream. Messages are sent in order, each after the
+    configured latency, by a background task.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        latency,
+        active_sessions,
+        channels=1,
+        interim_results=True,
+        model="general",
+    ):
+        self.websocket = websocket
+        self.latency = latency
+        # callable returning how many streams the server is handling
+        self.active_sessions = active_sessions
+        self.channels = channels
+        self.interim_results = interim_results
+        self.model = model
+        self.request_id = str(uuid.uuid4())
+        self.duration = 0.0
+        self.utterance_start = 0.0
+        self.last_interim = 0.0
+        self.outbox = asyncio.Queue()
+        self.sender = asyncio.ensure_future(self._send())
+
+    def audio(self, duration):
+        """Records that `duration` seconds of audio have been received in total."""
+        self.duration = duration
+        # wait until the last word of the utterance has been fully heard
+        while self.duration - self.utterance_start >= FINAL_INTERVAL + WORD_LENGTH:
+            end = self.utterance_start + FINAL_INTERVAL
+            self._queue(self._results(self.utterance_start, end, is_final=True))
+            self.utterance_start = self.last_interim = end
+
+        if self.interim_results and self.duration - self.last_interim >= INTERIM_INTERVAL:
+            self._queue(self._results(self.utterance_start, self.duration, is_final=False))
+            self.last_interim = self.duration
+
+    async def finish(self):
+        """Finalizes the last utterance and sends the closing metadata message."""
+        if self.duration > self.utterance_start:
+            self._queue(self._results(self.utterance_start, self.duration, is_final=True))
+        self._queue(self._metadata())
+        self.outbox.put_nowait(None)
+        await self.sender
+
+    def cancel(self):
+        self.sender.cancel()
+
+    def _queue(self, message):
+        loop = asyncio.get_running_loop()
+        due = loop.time() + self.latency.delay(self.active_sessions())
+        self.outbox.put_nowait((due, message))
+
+    async def _send(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.outbox.get()
+            if item is None:
+                return
+            due, message = item
+            # jitter can make a message due before the one ahead of it;
+            # it still goes out in order, as Deepgram's would
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.websocket.send(codec.dumps(message))
+
+    def _results(self, start, end, is_final):
+        # an utterance holds the words that start inside it and have been
+        # heard in full
+        words = []
+        index = math.ceil(start / WORD_INTERVAL - 1e-9)
+        while (
+            index * WORD_INTERVAL < end - 1e-9
+            and index * WORD_INTERVAL + WORD_LENGTH <= self.duration + 1e-9
+        ):
+            words.append(mock_word(index))
+            index += 1
+
+        return {
+            "type": "Results",
+            "channel_index": [0, self.channels],
+            "duration": round(end - start, 3),
+            "start": round(start, 3),
+            "is_final": is_final,
+            "speech_final": is_final,
+            "channel": {
+                "alternatives": [
+                    {
+                        "transcript": " ".join(word["punctuated_word"] for word in words),
+                        "confidence": 0.99 if words else 0.0,
+                        "words": words,
+                    }
+                ]
+            },
+            "metadata": {
+                "request_id": self.request_id,
+                "model_info": {"name": self.model, "version": "mock", "arch": "mock"},
+                "model_uuid": "00000000-0000-0000-0000-000000000000",
+            },
+        }
+
+    def _metadata(self):
+        return {
+            "type": "Metadata",
+            "transaction_key": "deprecated",
+            "request_id": self.request_id,
+            "sha256": hashlib.sha256(self.request_id.encode()).hexdigest(),
+            "created": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "duration": round(self.duration, 3),
+            "channels": self.channels,
+            "models": ["00000000-0000-0000-0000-000000000000"],
+            "model_info": {
+                "00000000-0000-0000-0000-000000000000": {
+                    "name": self.model,
+                    "version": "mock",
+                    "arch": "mock",
+                }
+            },
+        }
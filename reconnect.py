@@ -0,0 +1,189 @@
+"""A streaming connection that survives dropped websockets."""
+
+import asyncio
+import time
+from collections import deque
+
+import websockets
+import websockets.exceptions
+
+import codec
+
+# Close reasons that reconnecting can't fix
+FATAL_CLOSE_REASONS = ("DATA-0000",)
+
+
+class ResilientConnection:
+    """Streams audio over a websocket, reconnecting if the connection drops.
+
+    Audio goes through `send_audio()` and results come back from `results()`.
+    With `attempts` of 0 this is a thin wrapper around a single websocket, and
+    connection errors propagate as usual.
+
+    Otherwise the last `replay_seconds` of sent audio are kept. When the
+    connection drops with an error, it reconnects with exponential backoff
+    and resends the audio that has not been covered by a final result yet.
+    The new connection's results start from zero, so their `start` (and word
+    timings) are rebased onto the original stream's timeline before they are
+    handed out.
+    """
+
+    def __init__(
+        self,
+        connect,
+        byte_rate=None,
+        attempts=0,
+        replay_seconds=10.0,
+        backoff=0.5,
+        max_backoff=10.0,
+        log=print,
+    ):
+        # an async callable returning a new, open websocket
+        self.connect = connect
+        self.byte_rate = byte_rate
+        self.attempts = attempts if byte_rate else 0
+        self.replay_limit = int(replay_seconds * byte_rate) if self.attempts else 0
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.log = log
+
+        self.ws = None
+        self.lock = asyncio.Lock()
+        # where the current connection's audio starts on the stream's timeline
+        self.base = 0.0
+        # bytes of audio sent so far, and the most recent of them
+        self.bytes_sent = 0
+        self.replay = deque()
+        self.replay_bytes = 0
+        # end of the last final result, in seconds
+        self.finalized = 0.0
+        # whether CloseStream has been sent
+        self.closing = False
+
+        self.reconnects = 0
+        self.reconnect_time = 0.0
+        self.replayed_bytes = 0
+
+    async def __aenter__(self):
+        self.ws = await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.ws.close()
+
+    async def send_audio(self, chunk):
+        if self.replay_limit:
+            self._remember(bytes(chunk))
+        else:
+            self.bytes_sent += len(chunk)
+
+        ws = self.ws
+        try:
+            await ws.send(chunk)
+        except websockets.exceptions.ConnectionClosedError as e:
+            # the chunk is in the replay buffer, so reconnecting resends it
+            await self._reconnect(ws, e)
+
+    async def send_text(self, message):
+        ws = self.ws
+        try:
+            await ws.send(message)
+        except websockets.exceptions.ConnectionClosedError as e:
+            await self._reconnect(ws, e)
+            if not self.closing:
+                # otherwise reconnecting already sent CloseStream again
+                await self.ws.send(message)
+
+    async def close_stream(self):
+        """Asks the server to finish, which is repeated after any later reconnect."""
+        self.closing = True
+        await self.send_text(codec.dumps({"type": "CloseStream"}))
+
+    async def results(self):
+        """Yields each server message, decoded by `codec.decode()`, across reconnections."""
+        while True:
+            ws = self.ws
+            try:
+                async for msg in ws:
+                    res = codec.decode(msg)
+                    if self.base:
+                        self._rebase(res)
+                    if isinstance(res, codec.Result) and res.is_final:
+                        self.finalized = max(self.finalized, res.end)
+                    yield res
+                return
+            except websockets.exceptions.ConnectionClosedError as e:
+                await self._reconnect(ws, e)
+
+    def report(self):
+        return (
+            f"{self.reconnects} reconnect(s) taking {self.reconnect_time:.2f}s, "
+            f"{self.replayed_bytes} bytes replayed"
+        )
+
+    def _remember(self, chunk):
+        self.replay.append((self.bytes_sent, chunk))
+        self.bytes_sent += len(chunk)
+        self.replay_bytes += len(chunk)
+        while self.replay_bytes - len(self.replay[0][1]) >= self.replay_limit:
+            _, dropped = self.replay.popleft()
+            self.replay_bytes -= len(dropped)
+
+    def _rebase(self, res):
+        if isinstance(res, codec.Result):
+            res.start += self.base
+            for word in res.words:
+                word.start += self.base
+                word.end += self.base
+        elif "created" in res and "duration" in res:
+            res["duration"] += self.base
+
+    async def _reconnect(self, failed_ws, error):
+        async with self.lock:
+            if self.ws is not failed_ws:
+                # the other task already reconnected
+                return
+            if not self.attempts or error.reason in FATAL_CLOSE_REASONS:
+                raise error
+
+            self.log(
+                f"🟠 Connection closed with code {error.code} and payload {error.reason}, reconnecting"
+            )
+            started = time.monotonic()
+            delay = self.backoff
+            for attempt in range(1, self.attempts + 1):
+                await asyncio.sleep(delay)
+                try:
+                    ws = await self.connect()
+                    break
+                except (OSError, websockets.exceptions.WebSocketException) as e:
+                    self.log(f"🟠 Reconnect attempt {attempt} failed: {e}")
+                    delay = min(delay * 2, self.max_backoff)
+            else:
+                raise error
+
+            # resend everything after the last final result, starting from
+            # the chunk that contains it
+            finalized_bytes = int(self.finalized * self.byte_rate)
+            chunks = [
+                (offset, chunk)
+                for offset, chunk in self.replay
+                if offset + len(chunk) > finalized_bytes
+            ]
+            replay_from = chunks[0][0] if chunks else self.bytes_sent
+            if replay_from > finalized_bytes:
+                self.log(
+                    f"🟠 {(replay_from - finalized_bytes) / self.byte_rate:.2f}s of audio was older than the replay buffer and is lost"
+                )
+            for _, chunk in chunks:
+                await ws.send(chunk)
+                self.replayed_bytes += len(chunk)
+
+            if self.closing:
+                await ws.send(codec.dumps({"type": "CloseStream"}))
+
+            self.ws = ws
+            self.base = replay_from / self.byte_rate
+            self.reconnects += 1
+            self.reconnect_time += time.monotonic() - started
+            self.log(f"🟢 Reconnected, replayed {sum(len(c) for _, c in chunks)} bytes")
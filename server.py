@@ -1,60 +1,533 @@
+import argparse
 import asyncio
+import functools
+import itertools
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
+import queue
+import signal
+import socket
+import sys
 import websockets
 import time
 from urllib.parse import parse_qs
-import pydub
-import json
-from io import BytesIO
 import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import analysis
+import codec
+import storage
+from mock_asr import MockLatency, MockTranscriber
+from tracing import NOOP_SPAN, NOOP_TRACER, SERVER, open_tracer
+
 encoding_samplewidth_map = {"linear16": 2, "mulaw": 1}
 
+# WAVE format tags for the encodings we can containerize
+encoding_wavformat_map = {"linear16": 1, "mulaw": 7}
 
-def save_audio(encoding, sample_rate, channels, data):
-    # Save the raw audio data to a file
-    curr_time = datetime.now()
-    filename = curr_time.strftime("%Y%m%d_%H%M%S")
-    extension = "raw"
-    data_dir = os.path.abspath(os.path.join(os.path.curdir, "data"))
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+# The RIFF size fields are 32 bits wide
+MAX_WAV_DATA_SIZE = 0xFFFFFFFF - 36
 
-    with open(os.path.join("data", f"{filename}.{extension}"), "wb") as file:
-        file.write(data)
+# Recording I/O runs on a small thread pool, shared by every connection.
+PERSISTENCE_WORKERS = 4
+# How many frames a connection may have waiting for the pool before
+# `AsyncRecording.write` starts applying backpressure to that connection.
+PERSISTENCE_QUEUE_SIZE = 64
+
+# With --max-storage or --max-age, how often (in seconds) old segmented
+# recordings are looked for and removed.
+CLEANUP_INTERVAL = 60
+
+# Close codes for connections the server turns away or cuts off
+TRY_AGAIN_LATER = 1013
+POLICY_VIOLATION = 1008
+
+
+def wav_header(format_tag, sample_rate, channels, sample_width, data_size):
+    block_align = sample_width * channels
+    data_size = min(data_size, MAX_WAV_DATA_SIZE)
+    # the RIFF size counts the pad byte that follows odd-sized data
+    riff_size = min(36 + data_size + data_size % 2, 0xFFFFFFFF)
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        riff_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        format_tag,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        sample_width * 8,
+        b"data",
+        data_size,
+    )
+
+
+class RecordingWriter:
+    """Writes a stream's audio to disk as it arrives.
+
+    The raw bytes are appended to `data/<name>.raw`. For encodings with a
+    fixed sample width, a WAV copy is written alongside it: the header goes
+    out up front with empty sizes and is patched in `close()`, so nothing
+    but the current frame is ever held in memory.
+    """
+
+    def __init__(self, encoding, sample_rate, channels, data_dir="data", name_suffix=""):
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = encoding_samplewidth_map.get(encoding)
+        self.bytes_written = 0
+
+        # several workers may race to create the directory
+        os.makedirs(data_dir, exist_ok=True)
+
+        # streams opened in the same second get a numbered name rather
+        # than overwriting each other
+        base_name = datetime.now().strftime("%Y%m%d_%H%M%S") + name_suffix
+        for attempt in itertools.count():
+            name = f"{base_name}-{attempt}" if attempt else base_name
+            self.raw_path = os.path.join(data_dir, f"{name}.raw")
+            try:
+                self.raw_file = open(self.raw_path, "xb")
+                break
+            except FileExistsError:
+                continue
 
-    # Save to a containerized file,
-    # if using a format with a consistent bitrate
-    sample_width = encoding_samplewidth_map.get(encoding)
-    if sample_width:
         # we only support linear16 and mulaw right now
         # both of these can be waved as wav files
-        extension = "wav"
+        self.wav_path = None
+        self.wav_file = None
+        if self.sample_width:
+            self.wav_path = os.path.join(data_dir, f"{name}.wav")
+            self.wav_file = open(self.wav_path, "wb")
+            self.wav_file.write(self._wav_header())
 
-        audio_segment = pydub.AudioSegment.from_raw(
-            BytesIO(data),
-            sample_width=sample_width,
-            channels=channels,
-            frame_rate=sample_rate,
+    def _wav_header(self):
+        return wav_header(
+            encoding_wavformat_map[self.encoding],
+            self.sample_rate,
+            self.channels,
+            self.sample_width,
+            self.bytes_written,
+        )
+
+    def write(self, data):
+        self.raw_file.write(data)
+        if self.wav_file:
+            self.wav_file.write(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Finalizes the recording and returns the path of the most useful file."""
+        if self.raw_file.closed:
+            return self.wav_path or self.raw_path
+
+        self.raw_file.close()
+        if self.wav_file:
+            # RIFF chunks are word-aligned
+            if self.bytes_written % 2:
+                self.wav_file.write(b"\x00")
+            self.wav_file.seek(0)
+            self.wav_file.write(self._wav_header())
+            self.wav_file.close()
+            return self.wav_path
+
+        return self.raw_path
+
+
+class MemoryBudget:
+    """Bounds the audio a worker holds in memory across all of its connections.
+
+    A frame counts against the budget from when it is queued for writing
+    until it is on disk. A connection whose frame doesn't fit waits for
+    earlier frames to be written, so it stops reading and TCP pushes back on
+    its client; a frame larger than the whole budget only waits for the
+    budget to empty. A `limit` of 0 means no limit.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.freed = asyncio.Condition()
+
+    def exhausted(self):
+        return bool(self.limit) and self.used >= self.limit
+
+    async def acquire(self, size):
+        if not self.limit:
+            return
+        async with self.freed:
+            await self.freed.wait_for(
+                lambda: not self.used or self.used + size <= self.limit
+            )
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    async def release(self, size):
+        if not self.limit:
+            return
+        async with self.freed:
+            self.used -= size
+            self.freed.notify_all()
+
+
+class PersistenceStage:
+    """Runs all recording I/O on a bounded thread pool.
+
+    Opening, writing and finalizing recordings never happens on the event
+    loop, so a connection closing a large stream does not delay frames
+    arriving on the others.
+    """
+
+    def __init__(
+        self,
+        max_workers=PERSISTENCE_WORKERS,
+        queue_size=PERSISTENCE_QUEUE_SIZE,
+        name_suffix="",
+        memory_budget=0,
+        segment_seconds=0.0,
+        compression=None,
+    ):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="persistence"
+        )
+        self.queue_size = queue_size
+        # appended to recording names, e.g. to keep workers from colliding
+        self.name_suffix = name_suffix
+        self.recordings = set()
+        # audio queued for writing, across every connection
+        self.budget = MemoryBudget(memory_budget)
+        # each recording is one file, or with `segment_seconds` a directory
+        # of segments with an index
+        if segment_seconds:
+            self.writer = functools.partial(
+                storage.SegmentedRecordingWriter,
+                name_suffix=name_suffix,
+                segment_seconds=segment_seconds,
+                compression=compression,
+            )
+        else:
+            self.writer = functools.partial(RecordingWriter, name_suffix=name_suffix)
+
+    def open(self, encoding, sample_rate, channels):
+        recording = AsyncRecording(self, encoding, sample_rate, channels)
+        self.recordings.add(recording)
+        recording.task.add_done_callback(lambda _: self.recordings.discard(recording))
+        return recording
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def drain(self):
+        """Finalizes every open recording, then shuts the pool down."""
+        pending = list(self.recordings)
+        if pending:
+            log.info(f"Finishing {len(pending)} recording(s) before shutting down")
+        await asyncio.gather(
+            *(recording.close() for recording in pending), return_exceptions=True
+        )
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.executor.shutdown)
+
+
+class AsyncRecording:
+    """Event-loop side of a `RecordingWriter`.
+
+    Frames are queued and written in order by a per-connection task, which
+    coalesces whatever has queued up into a single write.
+    """
+
+    def __init__(self, stage, encoding, sample_rate, channels):
+        self.stage = stage
+        self.queue = asyncio.Queue(maxsize=stage.queue_size)
+        self.closing = False
+        self.session_id = None
+        self.task = asyncio.ensure_future(
+            self._run(encoding, sample_rate, channels)
         )
 
-        audio_segment.export(
-            os.path.join("data", f"{filename}.{extension}"), format=extension
+    async def write(self, data):
+        if self.task.done():
+            # writing failed, so raise its error rather than queue forever
+            await self._discard()
+            self.task.result()
+        await self.stage.budget.acquire(len(data))
+        await self.queue.put(data)
+
+    async def close(self):
+        """Waits for queued frames to reach disk and returns the saved filename."""
+        if not self.closing:
+            self.closing = True
+            if self.task.done():
+                await self._discard()
+            else:
+                await self.queue.put(None)
+        return await asyncio.shield(self.task)
+
+    async def _discard(self):
+        """Drops the frames still queued, which will never be written."""
+        size = 0
+        while not self.queue.empty():
+            size += len(self.queue.get_nowait() or b"")
+        await self.stage.budget.release(size)
+
+    async def _run(self, encoding, sample_rate, channels):
+        try:
+            return await self._record(encoding, sample_rate, channels)
+        except Exception:
+            # nothing will write the frames still queued; dropping them also
+            # unblocks a connection waiting to queue one, so its next write raises
+            await self._discard()
+            raise
+
+    async def _record(self, encoding, sample_rate, channels):
+        writer = await self.stage.run(
+            self.stage.writer, encoding, sample_rate, channels
+        )
+        self.session_id = getattr(writer, "session_id", None)
+        try:
+            done = False
+            while not done:
+                batch = [await self.queue.get()]
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                if batch:
+                    data = b"".join(batch)
+                    try:
+                        await self.stage.run(writer.write, data)
+                    finally:
+                        await self.stage.budget.release(len(data))
+        finally:
+            filename = await self.stage.run(writer.close)
+        return filename
+
+
+# Server-side output goes through a queue and is printed from a background
+# thread, so a slow terminal never blocks the event loop.
+log = logging.getLogger("server")
+
+
+def setup_logging(quiet=False):
+    """Routes server output to stdout via a background thread, unless `quiet`."""
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    # a forked worker may have inherited its parent's handlers
+    log.handlers.clear()
+    if quiet:
+        log.addHandler(logging.NullHandler())
+        return None
+
+    records = queue.SimpleQueue()
+    log.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(
+        records, logging.StreamHandler(sys.stdout)
+    )
+    listener.start()
+    return listener
+
+
+class ServerCounters:
+    """Connection and byte counters for each worker, in shared memory.
+
+    Every worker only ever writes its own slots, so no locking is needed; the
+    parent process reads them all to report totals.
+    """
+
+    FIELDS = ("connections", "active", "bytes", "rejected")
+
+    def __init__(self, workers, values=None):
+        self.workers = workers
+        self.values = values or multiprocessing.Array(
+            "q", workers * len(self.FIELDS), lock=False
         )
 
-    return os.path.join("data", f"{filename}.{extension}")
+    def worker(self, worker_id):
+        return WorkerCounters(self.values, worker_id * len(self.FIELDS))
+
+    def report(self):
+        lines = []
+        totals = [0] * len(self.FIELDS)
+        for worker_id in range(self.workers):
+            offset = worker_id * len(self.FIELDS)
+            row = self.values[offset : offset + len(self.FIELDS)]
+            totals = [total + value for total, value in zip(totals, row)]
+            lines.append(self._format(f"worker {worker_id}", row))
+        lines.append(self._format("total", totals))
+        return "\n".join(lines)
+
+    def _format(self, label, row):
+        connections, active, bytes_received, rejected = row
+        return f"{label}: {connections} connection(s), {active} active, {bytes_received} bytes received, {rejected} rejected"
+
+
+class WorkerCounters:
+    """One worker's view of `ServerCounters`."""
+
+    def __init__(self, values, offset):
+        self.values = values
+        self.offset = offset
+
+    def connection_opened(self):
+        self.values[self.offset] += 1
+        self.values[self.offset + 1] += 1
+
+    def connection_closed(self):
+        self.values[self.offset + 1] -= 1
+
+    def add_bytes(self, count):
+        self.values[self.offset + 2] += count
+
+    def connection_rejected(self):
+        self.values[self.offset + 3] += 1
+
+    def active(self):
+        return self.values[self.offset + 1]
+
+    def total_active(self):
+        """Active connections across every worker."""
+        fields = len(ServerCounters.FIELDS)
+        return sum(self.values[1 :: fields])
 
 
 # utility to send log messages to both server and client
 async def logger(websocket, message, key="msg"):
-    print(message)
+    log.info(message)
     msg_dict = {}
     msg_dict[key] = message
-    await websocket.send(json.dumps(msg_dict))
+    await websocket.send(codec.dumps(msg_dict))
+
+
+# utility to log a message on the server only, used when the client
+# should see nothing but Deepgram-shaped messages
+async def server_logger(websocket, message, key="msg"):
+    log.info(message)
+
+
+class Acknowledger:
+    """Decides when a connection is told how much audio has arrived.
+
+    Depending on `--ack`, an acknowledgement is sent every `--ack-frames`
+    frames, at most every `--ack-interval` milliseconds, or only once in the
+    close summary. Warnings are deduplicated: a repeated warning is sent at
+    most once per `--warning-interval` seconds, with a count of the copies
+    that were held back.
+    """
+
+    def __init__(self, websocket, options, notify=None):
+        self.websocket = websocket
+        self.notify = notify or logger
+        self.mode = options.ack
+        self.every_frames = max(1, options.ack_frames)
+        self.interval = options.ack_interval / 1000
+        self.warning_interval = options.warning_interval
+        self.frames = 0
+        self.unacked_frames = 0
+        self.last_ack = time.monotonic()
+        # warning message -> [time last sent, number suppressed since]
+        self.warnings = {}
+
+    async def frame(self, bytes_received):
+        self.frames += 1
+        self.unacked_frames += 1
+
+        if self.mode == "frames":
+            due = self.unacked_frames >= self.every_frames
+        elif self.mode == "interval":
+            due = time.monotonic() - self.last_ack >= self.interval
+        else:
+            due = False
+
+        if due:
+            await self.ack(bytes_received)
+
+    async def ack(self, bytes_received):
+        self.unacked_frames = 0
+        self.last_ack = time.monotonic()
+        await self.notify(self.websocket, f"Received {bytes_received} bytes of data")
+
+    async def warn(self, message):
+        now = time.monotonic()
+        state = self.warnings.setdefault(message, [None, 0])
+        last_sent, suppressed = state
+        if last_sent is not None and now - last_sent < self.warning_interval:
+            state[1] += 1
+            return
 
+        state[0], state[1] = now, 0
+        if suppressed:
+            message = f"{message} (repeated {suppressed} more times)"
+        await self.notify(self.websocket, message)
 
-async def audio_handler(websocket, path):
-    await logger(websocket, "New websocket connection opened")
+    async def summary(self, bytes_received):
+        # report anything the policy held back
+        for message, (_, suppressed) in list(self.warnings.items()):
+            if suppressed:
+                await self.notify(
+                    self.websocket, f"{message} (repeated {suppressed} more times)"
+                )
+        if self.mode == "summary":
+            await self.notify(
+                self.websocket,
+                f"Received {bytes_received} bytes of data in {self.frames} frames",
+            )
+        elif self.unacked_frames:
+            await self.ack(bytes_received)
+
+
+async def audio_handler(
+    websocket, path, persistence, options, counters, tracer=NOOP_TRACER
+):
+    # a traced client sends its span, which this session's span joins
+    span = tracer.span(
+        "session",
+        traceparent=websocket.request_headers.get("traceparent"),
+        kind=SERVER,
+        path=path,
+    )
+
+    # turn new sessions away while the server is full, asking them to retry
+    reason = None
+    if options.max_sessions and counters.total_active() >= options.max_sessions:
+        reason = "Too many concurrent sessions"
+    elif persistence.budget.exhausted():
+        reason = "Memory budget exhausted"
+    if reason:
+        counters.connection_rejected()
+        log.info(f"Rejecting connection: {reason}")
+        await websocket.close(code=TRY_AGAIN_LATER, reason=reason)
+        span.set(rejected=reason, close_code=TRY_AGAIN_LATER)
+        span.end()
+        return
+
+    counters.connection_opened()
+    try:
+        with span:
+            await stream_handler(websocket, path, persistence, options, counters, span)
+    finally:
+        counters.connection_closed()
+
+
+async def stream_handler(
+    websocket, path, persistence, options, counters, span=NOOP_SPAN
+):
+    # In mock ASR mode the client only gets Deepgram-shaped messages;
+    # everything else is logged on the server.
+    notify = server_logger if options.mock_asr else logger
+
+    await notify(websocket, "New websocket connection opened")
 
     # extract encoding and sample rate from the query string
     parsed_path = parse_qs(path.split("?")[1])
@@ -62,7 +535,7 @@ async def audio_handler(websocket, path):
     sample_rate = int(parsed_path.get("sample_rate", [0])[0])
     channels = int(parsed_path.get("channels", [1])[0])
 
-    await logger(
+    await notify(
         websocket,
         f"Expecting audio data with encoding {encoding}, {sample_rate} sample rate, and {channels} channel(s)",
     )
@@ -70,56 +543,484 @@ async def audio_handler(websocket, path):
     # For audio formats with non-variable sample widths,
     # we can do some calculations to confirm audio is being sent in real-time
     sample_width = encoding_samplewidth_map.get(encoding)
-    if sample_width:
-        # How many bytes are contained in one second of audio?
-        expected_bytes_per_second = sample_width * sample_rate * channels
+    # How many bytes are contained in one second of audio? 0 if the bitrate
+    # isn't fixed or the query leaves out the sample rate.
+    expected_bytes_per_second = sample_width * sample_rate * channels if sample_width else 0
+
+    span.set(encoding=encoding, sample_rate=sample_rate, channels=channels)
 
     start_time = time.time()
     bytes_received = 0
-    audio_data = bytearray(b"")
+    acks = Acknowledger(websocket, options, notify)
+    recording = persistence.open(encoding, sample_rate, channels)
+
+    analyzer = None
+    if options.analyze and expected_bytes_per_second:
+        analyzer = analysis.AudioAnalyzer(encoding, sample_rate, channels)
+
+    transcriber = None
+    if options.mock_asr:
+        transcriber = MockTranscriber(
+            websocket,
+            MockLatency(
+                options.mock_latency, options.mock_jitter, options.mock_load_latency
+            ),
+            counters.active,
+            channels=channels,
+            interim_results=parsed_path.get("interim_results", ["true"])[0] != "false",
+            model=parsed_path.get("model", ["general"])[0],
+        )
+
+    # when the last message of any kind, and the last audio, arrived
+    last_message = last_audio = time.monotonic()
 
     try:
-        async for message in websocket:
+        while True:
+            # Like Deepgram, hang up with NET-0001 on a client that has gone
+            # quiet for too long (KeepAlive counts only for --idle-timeout).
+            deadlines = []
+            if options.idle_timeout:
+                deadlines.append(last_message + options.idle_timeout)
+            if options.no_data_timeout:
+                deadlines.append(last_audio + options.no_data_timeout)
+            try:
+                message = await asyncio.wait_for(
+                    websocket.recv(),
+                    min(deadlines) - time.monotonic() if deadlines else None,
+                )
+            except asyncio.TimeoutError:
+                span.event("timeout")
+                await notify(websocket, "Closing connection: no audio received in time")
+                await websocket.close(code=1011, reason="NET-0001")
+                return
+            last_message = time.monotonic()
+
             # handle binary messages (audio data)
             if isinstance(message, bytes):
+                last_audio = last_message
+                if not bytes_received:
+                    span.event("first_audio")
                 # process the audio data received from the client
                 bytes_received += len(message)
-                audio_data += message
+                counters.add_bytes(len(message))
+
+                # without a fixed bitrate, assume the audio is arriving in real time
+                if expected_bytes_per_second:
+                    received_duration = bytes_received / expected_bytes_per_second
+                else:
+                    received_duration = time.time() - start_time
+
+                if (
+                    options.max_session_bytes
+                    and bytes_received > options.max_session_bytes
+                ) or (
+                    options.max_session_seconds
+                    and received_duration > options.max_session_seconds
+                ):
+                    # the recording keeps everything up to the limit
+                    span.event("session_limit")
+                    await notify(websocket, "Closing connection: session limit reached")
+                    await websocket.close(
+                        code=POLICY_VIOLATION, reason="Session limit exceeded"
+                    )
+                    return
 
-                if sample_width:
+                try:
+                    await recording.write(message)
+                except Exception:
+                    # e.g. the disk is full; the client would otherwise go on
+                    # sending audio that can't be saved
+                    span.event("recording_failed")
+                    await notify(websocket, "Closing connection: recording failed")
+                    await websocket.close(code=1011, reason="Recording failed")
+                    return
+                if analyzer:
+                    analyzer.add(message)
+
+                if expected_bytes_per_second:
                     # calculate the elapsed time
                     elapsed_time = time.time() - start_time
                     # validate the data rate
                     if bytes_received / elapsed_time > expected_bytes_per_second:
-                        await logger(
-                            websocket, f"Warning: stream may be faster than real time!"
+                        await acks.warn(
+                            "Warning: stream may be faster than real time!"
                         )
 
-                await logger(websocket, f"Received {bytes_received} bytes of data")
+                if transcriber:
+                    transcriber.audio(received_duration)
+
+                await acks.frame(bytes_received)
+
+                if options.drop_after and received_duration >= options.drop_after:
+                    # hang up the way Deepgram does when it loses the connection
+                    await notify(websocket, "Dropping connection on purpose")
+                    span.event("dropped")
+                    await websocket.close(code=1011, reason="NET-0000")
+                    return
 
             # handle stream closures or other text messages
             else:
-                json_message = json.loads(message)
+                json_message = codec.loads(message)
                 if json_message.get("type") == "CloseStream":
-                    # save the audio data to a file
-                    filename = save_audio(encoding, sample_rate, channels, audio_data)
-                    await logger(websocket, filename, "filename")
-                    await logger(websocket, len(audio_data), "total_bytes")
+                    span.event("close_stream_received")
+                    # finalize the audio files written during the stream
+                    filename = await recording.close()
+                    await acks.summary(bytes_received)
+                    await notify(websocket, filename, "filename")
+                    await notify(websocket, bytes_received, "total_bytes")
+                    if analyzer:
+                        analyzer.close()
+                        await notify(websocket, analyzer.summary(), "audio_stats")
+                        for problem in analyzer.problems():
+                            await notify(websocket, f"Audio check: {problem}")
+                    if transcriber:
+                        # like Deepgram, send the final results and metadata, then hang up
+                        await transcriber.finish()
+                        await websocket.close()
                     return
+                elif json_message.get("type") == "KeepAlive":
+                    # the client is holding back silence; nothing to do
+                    continue
                 else:
                     await websocket.close(code=1011, reason="Invalid frame sent")
                     return
 
     except websockets.exceptions.ConnectionClosedOK:
-        print("Client closed connection")
+        log.info("Client closed connection")
+    finally:
+        span.set(bytes_received=bytes_received, close_code=websocket.close_code)
+        if transcriber:
+            transcriber.cancel()
+        # keep whatever was received if the client went away without CloseStream
+        try:
+            await recording.close()
+        except Exception as e:
+            log.info(f"Recording failed: {e!r}")
 
 
-async def run_server():
-    port = 5000
-    server = await websockets.serve(audio_handler, "localhost", port)
-    print(f"Server is now listening for new connections on port {port}")
-    await server.wait_closed()
+async def clean_storage(persistence, options):
+    """Removes old segmented recordings every `CLEANUP_INTERVAL` seconds."""
+    while True:
+        try:
+            removed = await persistence.run(
+                functools.partial(
+                    storage.cleanup,
+                    "data",
+                    max_bytes=int(options.max_storage * 1024 * 1024),
+                    max_age=options.max_age * 3600,
+                    # a session is still being recorded if a segment was finished lately
+                    active_within=max(storage.ACTIVE_WITHIN, 2 * options.segment_seconds),
+                )
+            )
+        except Exception as e:
+            # try again next time rather than stop cleaning up for good
+            log.info(f"Cleaning up old recordings failed: {e!r}")
+        else:
+            if removed:
+                log.info(f"Removed {len(removed)} old recording session(s)")
+        await asyncio.sleep(CLEANUP_INTERVAL)
+
+
+async def run_server(options, worker_id=0, counters=None):
+    port = options.port
+    multiple_workers = options.workers > 1
+    counters = counters or ServerCounters(1).worker(0)
+    persistence = PersistenceStage(
+        name_suffix=f"_w{worker_id}" if multiple_workers else "",
+        memory_budget=int(options.memory_budget * 1024 * 1024),
+        segment_seconds=options.segment_seconds,
+        compression=options.compress,
+    )
+    # every worker appends its own spans to the trace file
+    tracer = open_tracer(options.trace, "server")
+    server = await websockets.serve(
+        functools.partial(
+            audio_handler,
+            persistence=persistence,
+            options=options,
+            counters=counters,
+            tracer=tracer,
+        ),
+        options.host,
+        port,
+        # let every worker bind the same port, the kernel balances connections
+        reuse_port=multiple_workers or None,
+    )
+    if multiple_workers:
+        log.info(f"Worker {worker_id} is now listening for new connections on port {port}")
+    else:
+        log.info(f"Server is now listening for new connections on port {port}")
+
+    # Stop accepting connections on Ctrl-C / SIGTERM, then let open
+    # recordings finish writing before exiting.
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+        except NotImplementedError:
+            # signal handlers are not available on Windows event loops
+            pass
+
+    cleaner = None
+    if options.segment_seconds and (options.max_storage or options.max_age):
+        cleaner = asyncio.ensure_future(clean_storage(persistence, options))
+
+    try:
+        await stop
+    finally:
+        if cleaner:
+            cleaner.cancel()
+        server.close()
+        await server.wait_closed()
+        await persistence.drain()
+        tracer.close()
+        if multiple_workers:
+            log.info(f"Worker {worker_id} shut down")
+        else:
+            log.info("Server shut down")
+
+
+def worker_main(worker_id, options, values):
+    listener = setup_logging(options.quiet)
+    counters = ServerCounters(options.workers, values).worker(worker_id)
+    try:
+        asyncio.run(run_server(options, worker_id, counters))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if listener:
+            listener.stop()
+
+
+def run_workers(options):
+    """Runs `options.workers` server processes sharing one port via SO_REUSEPORT."""
+    counters = ServerCounters(options.workers)
+    workers = [
+        multiprocessing.Process(
+            target=worker_main,
+            args=(worker_id, options, counters.values),
+            name=f"server-worker-{worker_id}",
+        )
+        for worker_id in range(options.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    # --quiet only silences the workers; the parent just reports counters
+    listener = setup_logging()
+
+    # Workers shut themselves down gracefully on SIGTERM; make sure they get
+    # one however the parent is asked to stop.
+    def stop_workers(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    try:
+        while True:
+            alive = [worker.sentinel for worker in workers if worker.is_alive()]
+            if not alive:
+                break
+            exited = multiprocessing.connection.wait(
+                alive, timeout=options.stats_interval or None
+            )
+            if not exited:
+                log.info(counters.report())
+        for worker in workers:
+            worker.join()
+        log.info(counters.report())
+    finally:
+        if listener:
+            listener.stop()
+
+
+def parse_args(argv=None):
+    """Parses the command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Receives and records audio from the streaming clients."
+    )
+    parser.add_argument(
+        "--host",
+        help='The interface to listen on. Defaults to "localhost".',
+        default="localhost",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        help="The port to listen on. Defaults to 5000.",
+        default=5000,
+        type=int,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="How many server processes to run. With more than one, the workers share the port via SO_REUSEPORT. Defaults to 1.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--stats-interval",
+        help="With multiple workers, how often (in seconds) to print connection and byte counters. Defaults to 0, which only prints them at shutdown.",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--ack",
+        choices=["frames", "interval", "summary"],
+        help='When to acknowledge received audio: every N frames ("frames"), at most once per interval ("interval"), or only in the close summary ("summary"). Defaults to "frames".',
+        default="frames",
+    )
+    parser.add_argument(
+        "--ack-frames",
+        help="With --ack frames, how many binary frames to receive between acknowledgements. Defaults to 1.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--ack-interval",
+        help="With --ack interval, the minimum number of milliseconds between acknowledgements. Defaults to 1000.",
+        default=1000,
+        type=float,
+    )
+    parser.add_argument(
+        "--warning-interval",
+        help="Minimum number of seconds between repeats of the same warning on a connection. Defaults to 5.",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--mock-asr",
+        help="Respond like Deepgram's streaming API, with interim and final Results messages and a closing Metadata message, instead of the local server messages.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--mock-latency",
+        help="With --mock-asr, how many milliseconds to wait before sending each response. Defaults to 0.",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--mock-jitter",
+        help="With --mock-asr, a random amount of up to this many milliseconds added to or taken from each response delay. Defaults to 0.",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--mock-load-latency",
+        help="With --mock-asr, how many milliseconds to add to each response delay for every other stream being handled. Defaults to 0.",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--analyze",
+        help="Measure each linear16/mulaw stream's level, clipping, DC offset, silence and inter-channel correlation (requires NumPy), and send the statistics with the close summary.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--drop-after",
+        help="Close every connection with an error after it has received this many seconds of audio, to test how clients recover. Defaults to never.",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--max-sessions",
+        help="Turn away new connections with close code 1013 (try again later) while this many are open, across all workers. Defaults to 0 (no limit).",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        help="Close a connection with a 1011/NET-0001 error, like Deepgram, if nothing (audio or KeepAlive) arrives on it for this many seconds. Deepgram uses 10. Defaults to 0 (never).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--no-data-timeout",
+        help="Close a connection with a 1011/NET-0001 error if no audio arrives on it for this many seconds, even if KeepAlive messages do. Defaults to 0 (never).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--max-session-bytes",
+        help="Close a connection with close code 1008 (policy violation) once it has sent more than this many bytes of audio. Defaults to 0 (no limit).",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--max-session-seconds",
+        help="Close a connection with close code 1008 (policy violation) once it has sent more than this many seconds of audio. Defaults to 0 (no limit).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--memory-budget",
+        help="How many megabytes of received audio each worker may hold in memory waiting to be written. Connections wait for room once it is spent, and new ones are turned away with close code 1013. Defaults to 0 (no limit).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--segment-seconds",
+        help="Record each session into a directory of this many seconds long segments, with an index for reading back time ranges (see storage.py), instead of a single file. Defaults to 0 (a single file).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--compress",
+        help="With --segment-seconds, compress the segments as they are written.",
+        default=None,
+        choices=storage.COMPRESSIONS,
+    )
+    parser.add_argument(
+        "--max-storage",
+        help="With --segment-seconds, remove the oldest sessions once all of them take up more than this many megabytes. Defaults to 0 (no limit).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--max-age",
+        help="With --segment-seconds, remove sessions this many hours after they were last written to. Defaults to 0 (keep them).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--trace",
+        help="Append a span for each connection (first audio, CloseStream, timeouts and how it closed) to this file as OpenTelemetry-shaped JSON lines, joined to the client's trace when it sends a traceparent header. See tracing.py.",
+        default=None,
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        help="Do not print server messages to stdout.",
+        action="store_true",
+    )
+    options = parser.parse_args(argv)
+    if (options.compress or options.max_storage or options.max_age) and not options.segment_seconds:
+        parser.error("--compress, --max-storage and --max-age require --segment-seconds")
+    if options.analyze and analysis.np is None:
+        parser.error("--analyze requires NumPy (pip install numpy)")
+    if options.workers < 1:
+        parser.error("--workers must be at least 1")
+    if options.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers requires SO_REUSEPORT, which this platform does not support")
+    return options
+
+
+def main():
+    options = parse_args()
+    if options.workers > 1:
+        return run_workers(options)
+
+    listener = setup_logging(options.quiet)
+    try:
+        asyncio.run(run_server(options))
+    finally:
+        if listener:
+            listener.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(run_server())
+    sys.exit(main() or 0)
@@ -0,0 +1,324 @@
+"""The inputs test_suite.py can stream from, each loaded on first use.
+
+A source is registered under the name `run()` is called with ("mic", "wav",
+"url", or "channel" for one channel of a `ChannelSplitter`). Its backend, such
+as PyAudio for the microphone or aiohttp for URLs, is only imported when the
+source is opened, so streaming a WAV file neither pays for those imports nor
+needs them installed.
+
+Every source has the query parameters describing its audio (`query`); for
+linear16 audio also its `sample_rate`, `channels`, and the number of bytes in
+one frame and in one second of it (`frame_size` and `byte_rate`; all None for
+other audio), `stream(send)` to send all of its audio through the async callable
+`send`, and `report()` returning lines to print once it is done.
+"""
+
+import asyncio
+import wave
+
+from capture import RingBuffer
+from metrics import format_summary
+from streaming import Pacer, StreamRelay, iter_chunks, wav_data_range
+
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+RATE = 16000
+CHUNK = 8000
+
+# How many seconds of captured audio can wait to be sent before the oldest
+# is dropped. Used for microphone streaming only.
+MIC_BUFFER_SECONDS = 5
+
+# Mimic sending a real-time stream by sending this many seconds of audio at a time.
+# Used for file "streaming" only.
+REALTIME_RESOLUTION = 0.250
+
+# Rates `transcode.Transcoder` can resample WAV and microphone audio to,
+# kept here so offering them doesn't import NumPy
+TARGET_RATES = (8000, 16000)
+
+# URL streams are sent in packets of this many bytes, about
+# `REALTIME_RESOLUTION` seconds of 128 kbps audio, with at most
+# `URL_QUEUE_PACKETS` read ahead of the websocket.
+URL_PACKET_SIZE = 4000
+URL_QUEUE_PACKETS = 16
+
+# How many chunks each channel of a `ChannelSplitter` may have waiting
+CHANNEL_QUEUE_CHUNKS = 8
+
+# name -> source class, filled in by @register
+SOURCES = {}
+
+
+def register(name):
+    def decorator(cls):
+        SOURCES[name] = cls
+        return cls
+
+    return decorator
+
+
+def open_source(name, options):
+    """Opens the source registered as `name`, configured from the `run()` options."""
+    try:
+        source = SOURCES[name]
+    except KeyError:
+        raise ValueError(f"{name} is not a known input source") from None
+    return source(options)
+
+
+def wav_params(path):
+    """Returns the `run` options describing a 16-bit WAV file."""
+    with wave.open(path, "rb") as fh:
+        (
+            channels,
+            sample_width,
+            sample_rate,
+            _,
+            _,
+            _,
+        ) = fh.getparams()
+    assert sample_width == 2, "WAV data must be 16-bit."
+    return {
+        "channels": channels,
+        "sample_width": sample_width,
+        "sample_rate": sample_rate,
+        "filepath": path,
+    }
+
+
+@register("mic")
+class MicSource:
+    """Streams from the microphone until it stops delivering audio.
+
+    Captured audio is handed over through a preallocated ring buffer, and
+    recorded to `recording_path` (if set) as it is sent rather than held in
+    memory.
+    """
+
+    def __init__(self, options):
+        try:
+            import pyaudio
+        except ImportError:
+            raise RuntimeError(
+                "Streaming from the microphone requires PyAudio. See the README for how to install it."
+            ) from None
+        self.pyaudio = pyaudio
+        self.query = f"&encoding=linear16&sample_rate={RATE}"
+        self.sample_rate = RATE
+        self.channels = CHANNELS
+        self.frame_size = SAMPLE_WIDTH * CHANNELS
+        self.byte_rate = self.frame_size * RATE
+        self.ring = RingBuffer(
+            int(MIC_BUFFER_SECONDS * RATE / CHUNK) or 1,
+            CHUNK * SAMPLE_WIDTH * CHANNELS,
+            asyncio.get_running_loop(),
+        )
+        self.recording_path = options.get("recording_path")
+        self.recording = None
+
+    # Runs on PortAudio's callback thread.
+    def _callback(self, input_data, frame_count, time_info, status_flag):
+        if status_flag & self.pyaudio.paInputOverflow:
+            self.ring.input_overflows += 1
+        self.ring.push(input_data)
+        return (input_data, self.pyaudio.paContinue)
+
+    async def _watch(self, stream):
+        while stream.is_active():
+            await asyncio.sleep(0.1)
+        self.ring.close()
+
+    async def stream(self, send):
+        if self.recording_path:
+            self.recording = wave.open(self.recording_path, "wb")
+            self.recording.setnchannels(CHANNELS)
+            self.recording.setsampwidth(SAMPLE_WIDTH)
+            self.recording.setframerate(RATE)
+
+        audio = self.pyaudio.PyAudio()
+        stream = audio.open(
+            format=self.pyaudio.paInt16,
+            channels=CHANNELS,
+            rate=RATE,
+            input=True,
+            frames_per_buffer=CHUNK,
+            stream_callback=self._callback,
+        )
+        stream.start_stream()
+        watcher = asyncio.ensure_future(self._watch(stream))
+
+        try:
+            while True:
+                data, captured_at = await self.ring.get()
+                if data is None:
+                    # the microphone stopped delivering audio
+                    break
+                if self.recording:
+                    # the header is patched when the recording is closed
+                    self.recording.writeframesraw(data)
+                await send(data)
+                self.ring.sent(captured_at)
+        finally:
+            watcher.cancel()
+            stream.stop_stream()
+            stream.close()
+            if self.recording:
+                self.recording.close()
+
+    def report(self):
+        lines = [
+            f"ℹ️  Mic capture: {self.ring.pushed} buffers, {self.ring.dropped} dropped, "
+            f"{self.ring.input_overflows} input overflows, at most {self.ring.max_depth} waiting",
+            format_summary("ℹ️  Capture to send latency", self.ring.send_latency),
+        ]
+        if self.recording:
+            lines.append(f"🟢 Mic audio saved to {self.recording_path}")
+        return lines
+
+
+@register("wav")
+class WavSource:
+    """Streams a 16-bit WAV file, paced like a live stream."""
+
+    def __init__(self, options):
+        self.filepath = options["filepath"]
+        channels = options["channels"]
+        sample_rate = options["sample_rate"]
+        self.query = f"&channels={channels}&sample_rate={sample_rate}&encoding=linear16"
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # How many bytes are in one frame (one sample for every channel)?
+        self.frame_size = options["sample_width"] * channels
+        # How many bytes are contained in one second of audio?
+        self.byte_rate = self.frame_size * sample_rate
+        self.pacer = Pacer(
+            options.get("speed", 1.0), options.get("burst", 0.0), options.get("span")
+        )
+
+    async def stream(self, send):
+        # How many bytes are in `REALTIME_RESOLUTION` seconds of audio?
+        # Keep whole frames in every chunk.
+        chunk_size = int(self.byte_rate * REALTIME_RESOLUTION)
+        chunk_size -= chunk_size % self.frame_size
+
+        # Stream the samples straight out of the file
+        offset, length = wav_data_range(self.filepath)
+        for chunk in iter_chunks(self.filepath, chunk_size, offset, length):
+            # Mimic real-time by waiting until the audio in this
+            # packet would have been spoken.
+            await self.pacer.wait(len(chunk) / self.byte_rate)
+            await send(chunk)
+
+    def report(self):
+        if not self.pacer.lateness:
+            return []
+        return [format_summary("ℹ️  Send lag behind schedule", self.pacer.lateness)]
+
+
+@register("url")
+class UrlSource:
+    """Relays a live audio stream from a URL.
+
+    The audio is re-framed into packets of a steady size. If Deepgram falls
+    behind, reading from the URL pauses rather than buffering without limit.
+    """
+
+    def __init__(self, options):
+        import aiohttp
+
+        self.aiohttp = aiohttp
+        self.url = options["url"]
+        # the stream describes its own encoding
+        self.query = ""
+        self.sample_rate = None
+        self.channels = None
+        self.frame_size = None
+        self.byte_rate = None
+        self.relay = StreamRelay(
+            options.get("url_packet_size") or URL_PACKET_SIZE, URL_QUEUE_PACKETS
+        )
+
+    async def stream(self, send):
+        async with self.aiohttp.ClientSession() as session:
+            async with session.get(self.url) as audio:
+                await self.relay.run(audio.content, send)
+
+    def report(self):
+        return [f"ℹ️  URL stream: {self.relay.report()}"]
+
+
+class ChannelSplitter:
+    """Reads a multichannel WAV file once and feeds each channel to its own stream.
+
+    Chunks are paced once for all channels, and each channel's samples are
+    taken with a strided view of the chunk, without de-interleaving the
+    whole file. Every channel has a short queue; if one stream falls behind,
+    reading waits for it, so the channels stay in step.
+    """
+
+    def __init__(self, options):
+        self.filepath = options["filepath"]
+        self.channels = options["channels"]
+        self.sample_width = options["sample_width"]
+        self.sample_rate = options["sample_rate"]
+        self.frame_size = self.sample_width * self.channels
+        self.byte_rate = self.frame_size * self.sample_rate
+        self.pacer = Pacer(
+            options.get("speed", 1.0), options.get("burst", 0.0), options.get("span")
+        )
+        self.queues = [
+            asyncio.Queue(maxsize=CHANNEL_QUEUE_CHUNKS) for _ in range(self.channels)
+        ]
+
+    async def run(self):
+        chunk_size = int(self.byte_rate * REALTIME_RESOLUTION)
+        chunk_size -= chunk_size % self.frame_size
+
+        try:
+            offset, length = wav_data_range(self.filepath)
+            for chunk in iter_chunks(self.filepath, chunk_size, offset, length):
+                await self.pacer.wait(len(chunk) / self.byte_rate)
+                # a channel's samples are every `channels`th sample of the chunk
+                with chunk.cast("h") as samples:
+                    for channel, queue in enumerate(self.queues):
+                        await queue.put(samples[channel :: self.channels].tobytes())
+        except BaseException:
+            # end every stream now, dropping the audio it hasn't sent
+            for queue in self.queues:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            raise
+
+        for queue in self.queues:
+            await queue.put(None)
+
+    def report(self):
+        if not self.pacer.lateness:
+            return []
+        return [format_summary("ℹ️  Send lag behind schedule", self.pacer.lateness)]
+
+
+@register("channel")
+class ChannelSource:
+    """Streams one channel of a `ChannelSplitter` as mono audio."""
+
+    def __init__(self, options):
+        splitter = options["splitter"]
+        self.queue = splitter.queues[options["channel"]]
+        self.sample_rate = splitter.sample_rate
+        self.channels = 1
+        self.frame_size = splitter.sample_width
+        self.byte_rate = self.frame_size * self.sample_rate
+        self.query = f"&channels=1&sample_rate={self.sample_rate}&encoding=linear16"
+
+    async def stream(self, send):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            await send(chunk)
+
+    def report(self):
+        return []
@@ -0,0 +1,281 @@
+"""Segmented recording storage for server.py (`--segment-seconds`).
+
+Each session gets its own directory, `data/<session id>/`, named with the
+time it opened and a random suffix, so sessions never collide however many
+open at once. Its audio is cut into segments of a fixed duration, optionally
+gzip-compressed as they are written, and `index.json` records which bytes
+and seconds of the session each segment holds. The index is rewritten
+whenever a segment is finished, so it is valid even if the server dies.
+
+    python storage.py data/20240101_120000_1a2b3c4d5e6f --start 60 --end 90 --output clip.wav
+
+reads a time range back by seeking into just the segments that cover it, and
+`cleanup()` removes the oldest sessions once they take up too much space or
+get too old.
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import shutil
+import time
+import uuid
+import wave
+from datetime import datetime
+
+INDEX_NAME = "index.json"
+
+# Fixed sample widths, from which byte offsets convert to seconds
+SAMPLE_WIDTHS = {"linear16": 2, "mulaw": 1}
+
+COMPRESSIONS = ("gzip",)
+
+# How recently (in seconds) an unfinished session must have been written to
+# for `cleanup()` to treat it as still being recorded
+ACTIVE_WITHIN = 3600
+
+
+def new_session_id(suffix=""):
+    """Returns a session ID that sorts by time and is unique across processes."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:12]}{suffix}"
+
+
+class SegmentedRecordingWriter:
+    """Writes a session's audio into fixed-duration segments with an index.
+
+    Has the same interface as `server.RecordingWriter`. For encodings without
+    a fixed sample width, segments are cut by the time the audio arrives
+    instead of by its length. Only the current segment is ever open.
+    """
+
+    def __init__(
+        self,
+        encoding,
+        sample_rate,
+        channels,
+        data_dir="data",
+        name_suffix="",
+        segment_seconds=60.0,
+        compression=None,
+    ):
+        self.session_id = new_session_id(name_suffix)
+        self.directory = os.path.join(data_dir, self.session_id)
+        os.makedirs(self.directory)
+        self.index_path = os.path.join(self.directory, INDEX_NAME)
+
+        sample_width = SAMPLE_WIDTHS.get(encoding)
+        self.byte_rate = sample_width * sample_rate * channels if sample_width else None
+        # cut segments on whole frames
+        frame_size = sample_width * channels if sample_width else 1
+        self.segment_bytes = None
+        if self.byte_rate:
+            self.segment_bytes = max(
+                frame_size, int(self.byte_rate * segment_seconds) // frame_size * frame_size
+            )
+        self.segment_seconds = segment_seconds
+        self.compression = compression
+
+        self.index = {
+            "session_id": self.session_id,
+            "encoding": encoding,
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "byte_rate": self.byte_rate,
+            "compression": compression,
+            "complete": False,
+            "segments": [],
+        }
+        self.bytes_written = 0
+        self.started = time.monotonic()
+        self.segment = None
+        self.closed = False
+        self._write_index()
+
+    def _open_segment(self):
+        number = len(self.index["segments"])
+        name = f"segment-{number:05}.raw" + (".gz" if self.compression == "gzip" else "")
+        path = os.path.join(self.directory, name)
+        if self.compression == "gzip":
+            # the fastest level, so compressing keeps up with many streams
+            self.segment = gzip.open(path, "xb", compresslevel=1)
+        else:
+            self.segment = open(path, "xb")
+        self.segment_entry = {
+            "file": name,
+            "start_byte": self.bytes_written,
+            "end_byte": self.bytes_written,
+            "start_seconds": self._seconds(),
+            "end_seconds": None,
+        }
+
+    def _seconds(self):
+        if self.byte_rate:
+            return self.bytes_written / self.byte_rate
+        return time.monotonic() - self.started
+
+    def _segment_full(self):
+        if self.segment_bytes:
+            return self.bytes_written - self.segment_entry["start_byte"] >= self.segment_bytes
+        return self._seconds() - self.segment_entry["start_seconds"] >= self.segment_seconds
+
+    def _close_segment(self):
+        self.segment.close()
+        self.segment = None
+        self.segment_entry["end_byte"] = self.bytes_written
+        self.segment_entry["end_seconds"] = self._seconds()
+        self.index["segments"].append(self.segment_entry)
+        self._write_index()
+
+    def _write_index(self):
+        # write a new file and swap it in, so readers never see a partial one
+        with open(f"{self.index_path}.tmp", "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self.segment is None:
+                self._open_segment()
+            if self.segment_bytes:
+                room = self.segment_bytes - (self.bytes_written - self.segment_entry["start_byte"])
+                piece, view = view[:room], view[room:]
+            else:
+                piece, view = view, view[len(view):]
+            self.segment.write(piece)
+            self.bytes_written += len(piece)
+            if self._segment_full():
+                self._close_segment()
+
+    def close(self):
+        """Finishes the last segment and the index, and returns the index's path."""
+        if not self.closed:
+            self.closed = True
+            if self.segment is not None:
+                self._close_segment()
+            self.index["complete"] = True
+            self._write_index()
+        return self.index_path
+
+
+def read_index(directory):
+    with open(os.path.join(directory, INDEX_NAME)) as f:
+        return json.load(f)
+
+
+def read_range(directory, start=0.0, end=None):
+    """Returns the audio a session recorded from `start` to `end` seconds.
+
+    Only the segments overlapping the range are opened, each at the offset
+    where the range begins. For encodings without a fixed sample width the
+    range is rounded out to whole segments.
+    """
+    index = read_index(directory)
+    segments = index["segments"]
+    if not segments:
+        return b""
+    byte_rate = index["byte_rate"]
+    frame_size = byte_rate // index["sample_rate"] if byte_rate else 1
+
+    # the first segment ending after `start`, up to the last starting before `end`
+    ends = [segment["end_seconds"] for segment in segments]
+    first = bisect.bisect_right(ends, start)
+    chunks = []
+    for segment in segments[first:]:
+        if end is not None and segment["start_seconds"] >= end:
+            break
+        offset = 0
+        length = segment["end_byte"] - segment["start_byte"]
+        if byte_rate:
+            wanted_from = int(start * byte_rate) // frame_size * frame_size
+            offset = max(0, wanted_from - segment["start_byte"])
+            if end is not None:
+                wanted_to = int(end * byte_rate) // frame_size * frame_size
+                length = min(length, wanted_to - segment["start_byte"])
+        path = os.path.join(directory, segment["file"])
+        opener = gzip.open if segment["file"].endswith(".gz") else open
+        with opener(path, "rb") as f:
+            f.seek(offset)
+            chunks.append(f.read(max(0, length - offset)))
+    return b"".join(chunks)
+
+
+def directory_size(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+def cleanup(data_dir, max_bytes=0, max_age=0.0, active_within=ACTIVE_WITHIN):
+    """Removes old sessions from `data_dir`, oldest first, and returns their IDs.
+
+    Sessions are removed while all of them together take up more than
+    `max_bytes`, and once they were last written more than `max_age` seconds
+    ago. A session that hasn't finished and was written to within
+    `active_within` seconds is still being recorded, possibly by another
+    worker, and is left alone.
+    """
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(data_dir)
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, INDEX_NAME))
+        ]
+    except FileNotFoundError:
+        return []
+
+    sessions = []
+    for entry in entries:
+        try:
+            sessions.append((entry.stat().st_mtime, entry.name, directory_size(entry.path)))
+        except OSError:
+            # another worker's cleanup removed it first
+            continue
+    sessions.sort()
+    total = sum(size for _, _, size in sessions)
+    now = time.time()
+    removed = []
+    for modified, name, size in sessions:
+        too_old = max_age and now - modified > max_age
+        too_big = max_bytes and total > max_bytes
+        if not (too_old or too_big):
+            continue
+        if now - modified < active_within:
+            try:
+                complete = read_index(os.path.join(data_dir, name))["complete"]
+            except OSError:
+                # removed by another worker in the meantime
+                total -= size
+                continue
+            if not complete:
+                continue
+        shutil.rmtree(os.path.join(data_dir, name), ignore_errors=True)
+        total -= size
+        removed.append(name)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reads a time range back from a segmented recording.")
+    parser.add_argument("session", help="The session's directory, holding its index.json.")
+    parser.add_argument("--start", help="Where the range starts, in seconds. Defaults to 0.", default=0.0, type=float)
+    parser.add_argument("--end", help="Where the range ends, in seconds. Defaults to the end of the recording.", default=None, type=float)
+    parser.add_argument("--output", help="The file to write: a WAV file if it ends in .wav and the encoding allows, otherwise raw audio.", required=True)
+    args = parser.parse_args()
+
+    index = read_index(args.session)
+    audio = read_range(args.session, args.start, args.end)
+    if args.output.lower().endswith(".wav") and index["encoding"] == "linear16":
+        with wave.open(args.output, "wb") as fh:
+            fh.setnchannels(index["channels"])
+            fh.setsampwidth(SAMPLE_WIDTHS["linear16"])
+            fh.setframerate(index["sample_rate"])
+            fh.writeframes(audio)
+    else:
+        with open(args.output, "wb") as f:
+            f.write(audio)
+    print(f"🟢 {len(audio)} bytes saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
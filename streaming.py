@@ -0,0 +1,206 @@
+"""Helpers shared by the scripts that stream audio files (client.py and test_suite.py)."""
+
+import argparse
+import asyncio
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from tracing import NOOP_SPAN
+
+
+def wav_data_range(path):
+    """Returns the (offset, length) in bytes of the audio data in a WAV file."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file.")
+
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk.")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"data":
+                offset = f.tell()
+                # files written by a live recorder may never have had their
+                # size patched, so trust the file over the header
+                return offset, min(chunk_size, size - offset)
+            # chunks are word-aligned
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def iter_chunks(path, chunk_size, offset=0, length=None):
+    """Yields consecutive `chunk_size` pieces of a file without copying them.
+
+    The file is memory-mapped, and each chunk is a memoryview into the
+    mapping, so neither startup time nor memory use grows with the length of
+    the file. A chunk is only valid until the next one is requested; copy it
+    with `bytes(chunk)` to keep it around.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        if end <= offset:
+            # an empty file can't be mapped
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for start in range(offset, end, chunk_size):
+                    with view[start : min(start + chunk_size, end)] as chunk:
+                        yield chunk
+            finally:
+                # the mapping can't be closed while views of it exist
+                view.release()
+
+
+class Pacer:
+    """Paces the sending of audio against deadlines on the monotonic clock.
+
+    Each call to `wait()` accounts for `duration` seconds of audio and returns
+    once that audio would have been fully spoken, so time spent sending and
+    event loop lag are absorbed rather than accumulated. `speed` scales the
+    clock (2 sends twice as fast as real time, 0 sends as fast as possible),
+    and the first `burst` seconds of audio go out without waiting at all.
+
+    How late each wait returned relative to its deadline is kept in `lateness`,
+    and recorded as a `send_lag` event on `span` when it is being traced.
+    """
+
+    def __init__(self, speed=1.0, burst=0.0, span=None):
+        self.speed = speed
+        self.burst = burst
+        self.span = span or NOOP_SPAN
+        self.start = None
+        self.audio_time = 0.0
+        self.lateness = array("d")
+
+    async def wait(self, duration):
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        self.audio_time += duration
+
+        if not self.speed:
+            # still give the rest of the event loop a turn
+            await asyncio.sleep(0)
+            return
+
+        deadline = self.start + max(0.0, self.audio_time - self.burst) / self.speed
+        if deadline > now:
+            await asyncio.sleep(deadline - now)
+            now = time.monotonic()
+        self.lateness.append(now - deadline)
+        if self.span.recording:
+            self.span.event("send_lag", lag_ms=(now - deadline) * 1000, audio_seconds=self.audio_time)
+
+
+def validate_speed(speed):
+    if speed.lower() in ("max", "0"):
+        return 0.0
+    try:
+        value = float(speed)
+    except ValueError:
+        value = -1.0
+    if value > 0:
+        return value
+
+    raise argparse.ArgumentTypeError(
+        f'{speed} is not a valid speed. Please enter a positive number such as 1, 2 or 10, or "max" to send as fast as possible.'
+    )
+
+
+class StreamRelay:
+    """Re-frames a byte stream into fixed-size packets and relays them, with backpressure.
+
+    A producer reads `packet_size` bytes at a time from `reader` (an aiohttp
+    `StreamReader`, or anything else with `readexactly`) into a queue of at
+    most `queue_size` packets, and a consumer sends them on. When sending
+    falls behind, the queue fills up and reading pauses, which in turn
+    throttles the network. Only the final packet may be short.
+
+    Network read throughput, queue depth, and how long each side spent
+    stalled waiting on the other are recorded for `report()`.
+    """
+
+    def __init__(self, packet_size, queue_size):
+        self.packet_size = packet_size
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.bytes_read = 0
+        self.read_time = 0.0
+        self.packets = 0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        # time the reader spent blocked on a full queue (sending is slow)
+        self.read_stall = 0.0
+        # time the sender spent waiting on an empty queue (the network is slow)
+        self.send_stall = 0.0
+
+    async def run(self, reader, send):
+        """Relays everything from `reader` to `send` (an async callable)."""
+        producer = asyncio.ensure_future(self._produce(reader))
+        try:
+            await self._consume(send)
+        finally:
+            producer.cancel()
+        # surface any read error
+        if not producer.cancelled() and producer.exception():
+            raise producer.exception()
+
+    async def _produce(self, reader):
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    packet = await reader.readexactly(self.packet_size)
+                    done = False
+                except asyncio.IncompleteReadError as e:
+                    packet = e.partial
+                    done = True
+                self.read_time += time.monotonic() - started
+                self.bytes_read += len(packet)
+
+                if packet:
+                    started = time.monotonic()
+                    await self.queue.put(packet)
+                    self.read_stall += time.monotonic() - started
+                    depth = self.queue.qsize()
+                    self.depth_samples += 1
+                    self.depth_total += depth
+                    self.max_depth = max(self.max_depth, depth)
+                if done:
+                    break
+        except asyncio.CancelledError:
+            # the consumer has already stopped, so nothing reads the queue
+            raise
+        except Exception:
+            # let the consumer send everything read so far; run() re-raises
+            await self.queue.put(b"")
+            raise
+        # an empty packet tells the consumer the stream has ended
+        await self.queue.put(b"")
+
+    async def _consume(self, send):
+        while True:
+            started = time.monotonic()
+            packet = await self.queue.get()
+            self.send_stall += time.monotonic() - started
+            if not packet:
+                return
+            await send(packet)
+            self.packets += 1
+
+    def report(self):
+        throughput = self.bytes_read / self.read_time if self.read_time else 0
+        mean_depth = self.depth_total / self.depth_samples if self.depth_samples else 0
+        return (
+            f"read {self.bytes_read} bytes at {throughput / 1000:.1f} kB/s into {self.packets} packets; "
+            f"queue depth mean {mean_depth:.1f}, max {self.max_depth}; "
+            f"reader stalled {self.read_stall:.2f}s, sender stalled {self.send_stall:.2f}s"
+        )
@@ -0,0 +1,194 @@
+"""Writes SRT/VTT subtitles as a stream is transcribed."""
+
+import os
+from collections import deque
+
+
+def subtitle_time_formatter(seconds, separator):
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = int(seconds % 60)
+    millis = int((seconds - int(seconds)) * 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02}{separator}{millis:03}"
+
+
+class SubtitleEngine:
+    """Turns one session's final results into numbered SRT/VTT cues.
+
+    Call `add()` with each final `codec.Result`; it returns the `(cue, end)` pairs
+    that are complete, and `flush()` returns the rest at the end of the
+    stream. By default every result becomes one cue. Results shorter than
+    `min_duration` seconds are held back and merged into the next one, and
+    with `max_chars` or `max_duration` set, cues are split between words
+    (using their timings) so that none is longer than that.
+
+    A `label` passed to `add()` (such as a speaker) is shown in its cues;
+    results with different labels are never merged into one cue.
+
+    The work per result is proportional to its words, and instances hold no
+    shared state, so any number of sessions can run side by side.
+    """
+
+    __slots__ = (
+        "separator",
+        "prefix",
+        "max_chars",
+        "max_duration",
+        "min_duration",
+        "number",
+        "pending",
+        "pending_start",
+        "pending_end",
+        "pending_label",
+        "format",
+    )
+
+    def __init__(self, format, max_chars=0, max_duration=0.0, min_duration=0.0):
+        self.format = format
+        self.separator = "," if format == "srt" else "."
+        self.prefix = "- " if format == "vtt" else ""
+        self.max_chars = max_chars
+        self.max_duration = max_duration
+        self.min_duration = min_duration
+        self.number = 0
+        # (text, start, end) of the words, or whole transcripts, not yet in a cue
+        self.pending = []
+        self.pending_start = 0.0
+        self.pending_end = 0.0
+        self.pending_label = None
+
+    def add(self, result, label=None):
+        if not result.transcript:
+            return []
+
+        cues = []
+        if self.pending and label != self.pending_label:
+            cues = self.flush()
+        self.pending_label = label
+
+        start = result.start
+        end = result.end
+        if not self.pending:
+            self.pending_start = start
+        self.pending_end = end
+
+        if result.words and (self.max_chars or self.max_duration):
+            self.pending.extend(
+                (word.punctuated_word, word.start, word.end) for word in result.words
+            )
+        else:
+            self.pending.append((result.transcript, start, end))
+
+        if end - self.pending_start < self.min_duration:
+            return cues
+        return cues + self.flush()
+
+    def flush(self):
+        """Returns cues for everything held back."""
+        cues = []
+        if not self.pending:
+            return cues
+
+        text = []
+        length = 0
+        cue_start = self.pending_start
+        cue_end = cue_start
+        for word, start, end in self.pending:
+            if text and (
+                (self.max_chars and length + 1 + len(word) > self.max_chars)
+                or (self.max_duration and end - cue_start > self.max_duration)
+            ):
+                cues.append(self._cue(" ".join(text), cue_start, cue_end))
+                text = []
+                length = 0
+                cue_start = start
+            length += len(word) + (1 if text else 0)
+            text.append(word)
+            cue_end = end
+
+        # the last cue runs to the end of the result, leaving no gap
+        cues.append(self._cue(" ".join(text), cue_start, self.pending_end))
+        self.pending = []
+        return cues
+
+    def _cue(self, text, start, end):
+        self.number += 1
+        if self.pending_label is None:
+            text = f"{self.prefix}{text}"
+        elif self.format == "vtt":
+            # a voice tag names the speaker in place of the dash
+            text = f"<v {self.pending_label}>{text}"
+        else:
+            text = f"{self.pending_label}: {text}"
+        cue = (
+            f"{self.number}\n"
+            f"{subtitle_time_formatter(start, self.separator)} --> "
+            f"{subtitle_time_formatter(end, self.separator)}\n"
+            f"{text}\n\n"
+        )
+        return cue, end
+
+
+class SubtitleSink:
+    """Appends subtitle cues to a file as they arrive.
+
+    The file is valid SRT/VTT after every cue, so nothing is lost if the
+    stream dies, and memory use doesn't grow with the session. It is flushed
+    to the OS after every `flush_every` cues and synced to disk after every
+    `fsync_every` cues (0 only syncs on close).
+
+    With a `window` of some seconds, the cues ending within that many seconds
+    of the latest one are also kept in a separate live file, replaced
+    atomically after each cue, which a player can poll without the file
+    growing.
+    """
+
+    def __init__(self, path, format, flush_every=1, fsync_every=0, window=0.0):
+        self.path = path
+        self.format = format
+        self.flush_every = max(1, flush_every)
+        self.fsync_every = fsync_every
+        self.window = window
+        self.header = "WEBVTT\n\n" if format == "vtt" else ""
+        self.cues = 0
+        self.recent = deque()
+
+        self.live_path = None
+        if window:
+            root, ext = os.path.splitext(path)
+            self.live_path = f"{root}.live{ext}"
+
+        self.file = open(path, "w")
+        self.file.write(self.header)
+        self.file.flush()
+
+    def write(self, cue, end):
+        """Appends the formatted `cue`, whose audio ends at `end` seconds."""
+        self.file.write(cue)
+        self.cues += 1
+        if self.fsync_every and self.cues % self.fsync_every == 0:
+            # fsync only reaches what has been flushed
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        elif self.cues % self.flush_every == 0:
+            self.file.flush()
+
+        if self.live_path:
+            self.recent.append((end, cue))
+            while self.recent[0][0] < end - self.window:
+                self.recent.popleft()
+            self._write_live()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def _write_live(self):
+        # write a new file and swap it in, so readers never see a partial one
+        with open(f"{self.live_path}.tmp", "w") as f:
+            f.write(self.header)
+            f.write("".join(cue for _, cue in self.recent))
+        os.replace(f"{self.live_path}.tmp", self.live_path)
@@ -1,69 +1,87 @@
-import pyaudio
 import argparse
 import asyncio
-import aiohttp
 import json
 import os
+import ssl
 import sys
-import wave
 import websockets
+import websockets.exceptions
 
+from collections import Counter
 from datetime import datetime
 
-startTime = datetime.now()
+from codec import Result
+from metrics import LatencyTracker, format_summary, summarize
+from reconnect import ResilientConnection
+from sources import TARGET_RATES, URL_PACKET_SIZE, ChannelSplitter, open_source, wav_params
+from streaming import validate_speed
+from subtitles import SubtitleEngine, SubtitleSink
+from tracing import CLIENT, NOOP_TRACER, open_tracer
 
-all_mic_data = []
-all_transcripts = []
+# With --reconnect, how many seconds of sent audio are kept to be sent again
+# after a dropped connection.
+REPLAY_SECONDS = 10
 
-FORMAT = pyaudio.paInt16
-CHANNELS = 1
-RATE = 16000
-CHUNK = 8000
 
-audio_queue = asyncio.Queue()
+def quiet(*args, **kwargs):
+    pass
 
-# Mimic sending a real-time stream by sending this many seconds of audio at a time.
-# Used for file "streaming" only.
-REALTIME_RESOLUTION = 0.250
 
-subtitle_line_counter = 0
-
-
-def subtitle_time_formatter(seconds, separator):
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds - int(seconds)) * 1000)
-    return f"{hours:02}:{minutes:02}:{secs:02}{separator}{millis:03}"
-
-
-def subtitle_formatter(response, format):
-    global subtitle_line_counter
-    subtitle_line_counter += 1
-
-    start = response["start"]
-    end = start + response["duration"]
-    transcript = response.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "")
-
-    separator = "," if format == "srt" else '.'
-    prefix = "- " if format == "vtt" else ""
-    subtitle_string = (
-        f"{subtitle_line_counter}\n"
-        f"{subtitle_time_formatter(start, separator)} --> "
-        f"{subtitle_time_formatter(end, separator)}\n"
-        f"{prefix}{transcript}\n\n"
+def open_subtitles(format, started, kwargs):
+    """Returns the `SubtitleEngine` and `SubtitleSink` for a session's subtitles."""
+    engine = SubtitleEngine(
+        format,
+        max_chars=kwargs.get("subtitle_max_chars") or 0,
+        max_duration=kwargs.get("subtitle_max_duration") or 0.0,
+        min_duration=kwargs.get("subtitle_min_duration") or 0.0,
     )
-
-    return subtitle_string
-
-
-# Used for microphone streaming only.
-def mic_callback(input_data, frame_count, time_info, status_flag):
-    audio_queue.put_nowait(input_data)
-    return (input_data, pyaudio.paContinue)
+    path = os.path.abspath(
+        kwargs.get("subtitle_path")
+        or os.path.join(
+            os.path.curdir, "data", f"{started.strftime('%Y%m%d%H%M')}.{format}"
+        )
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sink = SubtitleSink(
+        path,
+        format,
+        flush_every=kwargs.get("subtitle_flush") or 1,
+        fsync_every=kwargs.get("subtitle_fsync") or 0,
+        window=kwargs.get("subtitle_window") or 0.0,
+    )
+    return engine, sink
 
 
 async def run(key, method, format, **kwargs):
+    """Streams one input to Deepgram and returns a summary of the results.
+
+    The final transcripts are only kept, as the summary's "transcripts", with
+    `collect_transcripts=True`, so a long session doesn't grow in memory.
+    """
+    tracer = kwargs.get("tracer") or NOOP_TRACER
+    with tracer.span(
+        "stream",
+        parent=kwargs.get("parent_span"),
+        kind=CLIENT,
+        method=method,
+        input=kwargs.get("filepath") or kwargs.get("url") or method,
+        format=format,
+        channel=kwargs.get("channel"),
+    ) as span:
+        result = await stream(key, method, format, span, **kwargs)
+        span.set(request_id=result["request_id"], duration=result["duration"])
+        return result
+
+
+async def stream(key, method, format, span, **kwargs):
+    """Runs one traced stream for `run()`."""
+    log = quiet if kwargs.get("quiet") else print
+    result = {"request_id": None, "duration": None, "latency": None}
+    if kwargs.get("collect_transcripts"):
+        result["transcripts"] = []
+    # names the files this session saves
+    started = datetime.now()
+
     deepgram_url = f'{kwargs["host"]}/v1/listen?punctuate=true'
 
     if kwargs["model"]:
@@ -72,207 +90,340 @@ async def run(key, method, format, **kwargs):
     if kwargs["tier"]:
         deepgram_url += f"&tier={kwargs['tier']}"
 
-    if method == "mic":
-        deepgram_url += "&encoding=linear16&sample_rate=16000"
+    # The input's backend is only loaded now, when it is needed
+    source_options = dict(kwargs, span=span)
+    if method == "mic" and (format == "vtt" or format == "srt"):
+        data_dir = os.path.abspath(os.path.join(os.path.curdir, "data"))
+        os.makedirs(data_dir, exist_ok=True)
+        source_options["recording_path"] = os.path.join(
+            data_dir, f"{started.strftime('%Y%m%d%H%M')}.wav"
+        )
+    source = open_source(method, source_options)
+
+    # Optionally convert the audio before it is sent, to save bandwidth
+    transcoder = None
+    if kwargs.get("encoding") == "mulaw" or kwargs.get("resample") or kwargs.get("mono"):
+        if source.byte_rate:
+            from transcode import Transcoder
+
+            transcoder = Transcoder(
+                source.sample_rate,
+                source.channels,
+                encoding=kwargs.get("encoding") or "linear16",
+                target_rate=kwargs.get("resample"),
+                mono=kwargs.get("mono", False),
+            )
+        else:
+            log("🟠 Transcoding is not supported for URL streams, so it is disabled")
+    deepgram_url += transcoder.query if transcoder else source.query
+
+    if kwargs.get("reconnect") and not source.byte_rate:
+        log("🟠 Reconnecting is not supported for URL streams, so it is disabled")
+
+    # With --vad, silence is held back and KeepAlive messages sent instead
+    gate = None
+    if kwargs.get("vad"):
+        if source.byte_rate:
+            from vad import SilenceGate
+
+            gate = SilenceGate(
+                source.byte_rate,
+                source.frame_size,
+                threshold=kwargs.get("vad_threshold", -45.0),
+                hangover=kwargs.get("vad_hangover", 0.5),
+                preroll=kwargs.get("vad_preroll", 0.25),
+                keepalive=kwargs.get("keepalive_interval", 5.0),
+            )
+        else:
+            log("🟠 The silence gate is not supported for URL streams, so it is disabled")
+
+    # Matches final transcripts to the audio they cover, to measure latency.
+    # Only possible when we know how much audio each chunk holds.
+    latency = LatencyTracker()
+
+    # Subtitles are appended to their file as each final result arrives.
+    subtitle_sink = None
+    if format == "vtt" or format == "srt":
+        subtitle_engine, subtitle_sink = open_subtitles(format, started, kwargs)
 
-    elif method == "wav":
-        data = kwargs["data"]
-        deepgram_url += f'&channels={kwargs["channels"]}&sample_rate={kwargs["sample_rate"]}&encoding=linear16'
+    connect_options = {}
+    if kwargs.get("ssl_context") and deepgram_url.startswith("wss://"):
+        # batch runs share one TLS context rather than loading certificates per file
+        connect_options["ssl"] = kwargs["ssl_context"]
 
     # Connect to the real-time streaming endpoint, attaching our credentials.
-    async with websockets.connect(
-        deepgram_url, extra_headers={"Authorization": "Token {}".format(key)}
-    ) as ws:
-        print(f'ℹ️  Request ID: {ws.response_headers.get("dg-request-id")}')
+    headers = {"Authorization": "Token {}".format(key)}
+    if span.recording:
+        # lets a local server.py --trace join its span to ours
+        headers["traceparent"] = span.traceparent()
+
+    async def connect():
+        with span.child("connect", kind=CLIENT, url=deepgram_url):
+            return await websockets.connect(
+                deepgram_url, extra_headers=headers, **connect_options
+            )
+
+    # With --reconnect, a dropped connection is opened again and the audio
+    # not yet covered by a final transcript is replayed.
+    async with ResilientConnection(
+        connect,
+        byte_rate=transcoder.byte_rate if transcoder else source.byte_rate,
+        attempts=kwargs.get("reconnect") or 0,
+        replay_seconds=kwargs.get("replay_seconds") or REPLAY_SECONDS,
+        log=log,
+    ) as connection:
+        request_id = connection.ws.response_headers.get("dg-request-id")
+        result["request_id"] = request_id
+        log(f"ℹ️  Request ID: {request_id}")
         if kwargs["model"]:
-            print(f'ℹ️  Model: {kwargs["model"]}')
+            log(f'ℹ️  Model: {kwargs["model"]}')
         if kwargs["tier"]:
-            print(f'ℹ️  Tier: {kwargs["tier"]}')
-        print("🟢 (1/5) Successfully opened Deepgram streaming connection")
+            log(f'ℹ️  Tier: {kwargs["tier"]}')
+        log("🟢 (1/5) Successfully opened Deepgram streaming connection")
 
-        async def sender(ws):
-            print(
+        async def sender(connection):
+            log(
                 f'🟢 (2/5) Ready to stream {method if (method == "mic" or method == "url") else kwargs["filepath"]} audio to Deepgram{". Speak into your microphone to transcribe." if method == "mic" else ""}'
             )
 
-            if method == "mic":
-                try:
-                    while True:
-                        mic_data = await audio_queue.get()
-                        all_mic_data.append(mic_data)
-                        await ws.send(mic_data)
-                except websockets.exceptions.ConnectionClosedOK:
-                    await ws.send(json.dumps({"type": "CloseStream"}))
-                    print(
-                        "🟢 (5/5) Successfully closed Deepgram connection, waiting for final transcripts if necessary"
-                    )
-
-                except Exception as e:
-                    print(f"Error while sending: {str(e)}")
-                    raise
-
-            elif method == "url":
-                # Listen for the connection to open and send streaming audio from the URL to Deepgram
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(kwargs["url"]) as audio:
-                        while True:
-                            remote_url_data = await audio.content.readany()
-                            await ws.send(remote_url_data)
-
-                            # If no data is being sent from the live stream, then break out of the loop.
-                            if not remote_url_data:
-                                break
-
-            elif method == "wav":
-                nonlocal data
-                # How many bytes are contained in one second of audio?
-                byte_rate = (
-                    kwargs["sample_width"] * kwargs["sample_rate"] * kwargs["channels"]
-                )
-                # How many bytes are in `REALTIME_RESOLUTION` seconds of audio?
-                chunk_size = int(byte_rate * REALTIME_RESOLUTION)
-
-                try:
-                    while len(data):
-                        chunk, data = data[:chunk_size], data[chunk_size:]
-                        # Mimic real-time by waiting `REALTIME_RESOLUTION` seconds
-                        # before the next packet.
-                        await asyncio.sleep(REALTIME_RESOLUTION)
-                        # Send the data
-                        await ws.send(chunk)
-
-                    await ws.send(json.dumps({"type": "CloseStream"}))
-                    print(
-                        "🟢 (5/5) Successfully closed Deepgram connection, waiting for final transcripts if necessary"
-                    )
-                except Exception as e:
-                    print(f"🔴 ERROR: Something happened while sending, {e}")
-                    raise e
-
-            return
+            audio_offset = 0.0
+            first_byte = True
+
+            async def send_audio(chunk):
+                if transcoder:
+                    chunk = transcoder.process(chunk)
+                if chunk:
+                    await connection.send_audio(chunk)
+
+            async def send(chunk):
+                nonlocal audio_offset, first_byte
+                if first_byte:
+                    span.event("first_byte_sent")
+                    first_byte = False
+                if gate:
+                    await gate.send(chunk, send_audio, connection.send_text)
+                else:
+                    await send_audio(chunk)
+                if source.byte_rate:
+                    audio_offset += len(chunk) / source.byte_rate
+                    latency.sent(audio_offset)
+
+            try:
+                await source.stream(send)
+                await connection.close_stream()
+                span.event("close_stream_sent")
+            except websockets.exceptions.ConnectionClosedOK:
+                # the stream was already closed, e.g. by saying "goodbye"
+                pass
+            except Exception as e:
+                log(f"🔴 ERROR: Something happened while sending, {e}")
+                raise e
+
+            for line in source.report():
+                log(line)
+            if gate:
+                log(f"ℹ️  Silence gate: {gate.report()}")
+            if transcoder:
+                log(f"ℹ️  Transcoding: {transcoder.report()}")
+            log(
+                "🟢 (5/5) Successfully closed Deepgram connection, waiting for final transcripts if necessary"
+            )
 
-        async def receiver(ws):
+        async def receiver(connection):
             """Print out the messages received from the server."""
             first_message = True
             first_transcript = True
             transcript = ""
 
-            async for msg in ws:
-                res = json.loads(msg)
+            async for res in connection.results():
                 if first_message:
-                    print(
+                    span.event("first_message")
+                    log(
                         "🟢 (3/5) Successfully receiving Deepgram messages, waiting for finalized transcription..."
                     )
                     first_message = False
+                # Results arrive decoded; anything else is a plain dict
+                is_result = isinstance(res, Result)
+                if gate and is_result:
+                    # the server only heard the audio that got through the gate
+                    gate.rebase(res)
                 try:
                     # handle local server messages
-                    if res.get("msg"):
-                        print(res["msg"])
-                    if res.get("is_final"):
-                        transcript = (
-                            res.get("channel", {})
-                            .get("alternatives", [{}])[0]
-                            .get("transcript", "")
-                        )
+                    if not is_result and res.get("msg"):
+                        log(res["msg"])
+                    if not is_result and res.get("audio_stats"):
+                        log(f'ℹ️  Audio stats: {res["audio_stats"]}')
+                    if is_result and res.is_final:
+                        transcript = res.transcript
+                        if transcript != "":
+                            utterance_latency = latency.finalized(
+                                res.start, res.end, transcript
+                            )
+                            if kwargs["latency"] and utterance_latency is not None:
+                                log(
+                                    f"ℹ️  Finalized {res.start:.2f}s - {res.end:.2f}s after {utterance_latency * 1000:.0f}ms"
+                                )
                         if kwargs["timestamps"]:
-                            words = res.get("channel", {}).get("alternatives", [{}])[0].get("words", [])
-                            start = words[0]["start"] if words else None
-                            end = words[-1]["end"] if words else None
+                            start = res.words[0].start if res.words else None
+                            end = res.words[-1].end if res.words else None
                             transcript += " [{} - {}]".format(start, end) if (start and end) else ""
                         if transcript != "":
                             if first_transcript:
-                                print("🟢 (4/5) Began receiving transcription")
+                                span.event("first_final_transcript")
+                                log("🟢 (4/5) Began receiving transcription")
                                 # if using webvtt, print out header
                                 if format == "vtt":
-                                    print("WEBVTT\n")
+                                    log("WEBVTT\n")
                                 first_transcript = False
+                            if "transcripts" in result:
+                                result["transcripts"].append(res.transcript)
+                            if kwargs.get("on_final"):
+                                kwargs["on_final"](res)
                             if format == "vtt" or format == "srt":
-                                transcript = subtitle_formatter(res, format)
-                            print(transcript)
-                            all_transcripts.append(transcript)
+                                for cue, end in subtitle_engine.add(res):
+                                    subtitle_sink.write(cue, end)
+                                    log(cue)
+                            else:
+                                log(transcript)
 
                         # if using the microphone, close stream if user says "goodbye"
                         if method == "mic" and "goodbye" in transcript.lower():
-                            await ws.send(json.dumps({"type": "CloseStream"}))
-                            print(
+                            await connection.close_stream()
+                            log(
                                 "🟢 (5/5) Successfully closed Deepgram connection, waiting for final transcripts if necessary"
                             )
 
                     # handle end of stream
-                    if res.get("created"):
-                        # save subtitle data if specified
+                    if not is_result and res.get("created"):
+                        span.event("final_metadata")
+                        if gate:
+                            res["duration"] = gate.source_time(res["duration"])
+                        # the subtitles were written as we went along
                         if format == "vtt" or format == "srt":
-                            data_dir = os.path.abspath(
-                                os.path.join(os.path.curdir, "data")
-                            )
-                            if not os.path.exists(data_dir):
-                                os.makedirs(data_dir)
-
-                            transcript_file_path = os.path.abspath(
-                                os.path.join(
-                                    data_dir,
-                                    f"{startTime.strftime('%Y%m%d%H%M')}.{format}",
+                            for cue, end in subtitle_engine.flush():
+                                subtitle_sink.write(cue, end)
+                                log(cue)
+                            subtitle_sink.close()
+                            log(f"🟢 Subtitles saved to {subtitle_sink.path}")
+
+                        result["duration"] = res["duration"]
+                        result["latency"] = summarize(latency.latencies)
+                        if latency.latencies:
+                            log(
+                                format_summary(
+                                    "ℹ️  Finalization latency", latency.latencies
                                 )
                             )
-                            with open(transcript_file_path, "w") as f:
-                                f.write("".join(all_transcripts))
-                            print(f"🟢 Subtitles saved to {transcript_file_path}")
-
-                            # also save mic data if we were live streaming audio
-                            # otherwise the wav file will already be saved to disk
-                            if method == "mic":
-                                wave_file_path = os.path.abspath(
-                                    os.path.join(
-                                        data_dir,
-                                        f"{startTime.strftime('%Y%m%d%H%M')}.wav",
-                                    )
-                                )
-                                wave_file = wave.open(wave_file_path, "wb")
-                                wave_file.setnchannels(CHANNELS)
-                                wave_file.setsampwidth(SAMPLE_SIZE)
-                                wave_file.setframerate(RATE)
-                                wave_file.writeframes(b"".join(all_mic_data))
-                                wave_file.close()
-                                print(f"🟢 Mic audio saved to {wave_file_path}")
-
-                        print(
+                        if kwargs["latency_json"]:
+                            latency.export(kwargs["latency_json"])
+                            log(f'🟢 Latency report saved to {kwargs["latency_json"]}')
+                        if connection.reconnects:
+                            log(f"ℹ️  Reconnects: {connection.report()}")
+
+                        log(
                             f'🟢 Request finished with a duration of {res["duration"]} seconds. Exiting!'
                         )
                 except KeyError:
-                    print(f"🔴 ERROR: Received unexpected API response! {msg}")
-
-        # Set up microphone if streaming from mic
-        async def microphone():
-            audio = pyaudio.PyAudio()
-            stream = audio.open(
-                format=FORMAT,
-                channels=CHANNELS,
-                rate=RATE,
-                input=True,
-                frames_per_buffer=CHUNK,
-                stream_callback=mic_callback,
-            )
-
-            stream.start_stream()
-
-            global SAMPLE_SIZE
-            SAMPLE_SIZE = audio.get_sample_size(FORMAT)
-
-            while stream.is_active():
-                await asyncio.sleep(0.1)
-
-            stream.stop_stream()
-            stream.close()
+                    log(f"🔴 ERROR: Received unexpected API response! {res}")
 
         functions = [
-            asyncio.ensure_future(sender(ws)),
-            asyncio.ensure_future(receiver(ws)),
+            asyncio.ensure_future(sender(connection)),
+            asyncio.ensure_future(receiver(connection)),
         ]
 
-        if method == "mic":
-            functions.append(asyncio.ensure_future(microphone()))
-
-        await asyncio.gather(*functions)
+        try:
+            await asyncio.gather(*functions)
+        finally:
+            # keep the cues received so far if the stream failed
+            if subtitle_sink:
+                subtitle_sink.close()
+
+        result["reconnects"] = connection.reconnects
+        result["reconnect_time"] = connection.reconnect_time
+        result["replayed_bytes"] = connection.replayed_bytes
+
+    return result
+
+
+async def run_channels(key, format, **kwargs):
+    """Streams each channel of a WAV file over its own connection, side by side.
+
+    The file is read once and each channel sent as mono audio, at the same
+    pace for all of them. Final transcripts are printed as they arrive and
+    merged into one timeline, ordered by start time and then channel, which
+    is printed at the end in text mode and written out as the subtitle file
+    otherwise; the transcript list returned follows it too.
+    """
+    started = datetime.now()
+    splitter = ChannelSplitter(kwargs)
+    print(f'🟢 Streaming the {splitter.channels} channels of {kwargs["filepath"]} separately')
+
+    # (start, channel, result) for every final transcript
+    finals = []
+
+    def on_final(channel):
+        def add(res):
+            finals.append((res.start, channel, res))
+            print(f"[Channel {channel}] {res.transcript}")
+
+        return add
+
+    # every connection would write the same report, so there is none
+    options = dict(kwargs, latency_json=None)
+    tracer = kwargs.get("tracer") or NOOP_TRACER
+    span = tracer.span("split_channels", input=kwargs["filepath"], channels=splitter.channels)
+    options["parent_span"] = span
+    with span:
+        results = await asyncio.gather(
+            splitter.run(),
+            *(
+                run(
+                    key,
+                    "channel",
+                    "text",
+                    quiet=True,
+                    splitter=splitter,
+                    channel=channel,
+                    on_final=on_final(channel),
+                    **options,
+                )
+                for channel in range(splitter.channels)
+            ),
+        )
+    results = results[1:]
+    for line in splitter.report():
+        print(line)
+
+    finals.sort(key=lambda final: final[:2])
+    transcripts = [f"Channel {channel}: {res.transcript}" for _, channel, res in finals]
+
+    if format == "text":
+        print("🟢 Transcripts of all channels, by start time:")
+        for start, channel, res in finals:
+            print(f"[{start:.2f}s] Channel {channel}: {res.transcript}")
+    elif format == "vtt" or format == "srt":
+        engine, sink = open_subtitles(format, started, kwargs)
+        try:
+            for _, channel, res in finals:
+                for cue, end in engine.add(res, label=f"Channel {channel}"):
+                    sink.write(cue, end)
+            for cue, end in engine.flush():
+                sink.write(cue, end)
+        finally:
+            sink.close()
+        print(f"🟢 Subtitles saved to {sink.path}")
+
+    for channel, result in enumerate(results):
+        print(f'ℹ️  Channel {channel}: request ID {result["request_id"]}, duration {result["duration"]} seconds')
+        if result["latency"] and result["latency"]["count"]:
+            print(f'ℹ️  Channel {channel} finalization latency: p50 {result["latency"]["p50"] * 1000:.0f}ms, p95 {result["latency"]["p95"] * 1000:.0f}ms')
+
+    durations = [result["duration"] for result in results if result["duration"] is not None]
+    return {
+        "channels": results,
+        "transcripts": transcripts,
+        "duration": max(durations) if durations else None,
+    }
 
 
 def validate_input(input):
@@ -303,6 +454,15 @@ def validate_format(format):
         f'{format} is invalid. Please enter "text", "vtt", or "srt".'
     )
 
+def validate_batch(batch):
+    if os.path.isdir(batch) or (batch.lower().endswith(".jsonl") and os.path.exists(batch)):
+        return batch
+
+    raise argparse.ArgumentTypeError(
+        f"{batch} is invalid. Please enter a directory of WAV files or the path to a JSONL manifest."
+    )
+
+
 def validate_dg_host(dg_host):
     if (
         # Check that the host is a websocket URL
@@ -368,6 +528,156 @@ def parse_args():
         default="text",
         type=validate_format,
     )
+    parser.add_argument(
+        "--subtitle-max-chars",
+        help="With VTT or SRT, split cues between words so that none is longer than this many characters. Defaults to 0 (one cue per final result).",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--subtitle-max-duration",
+        help="With VTT or SRT, split cues between words so that none lasts longer than this many seconds. Defaults to 0 (no limit).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--subtitle-min-duration",
+        help="With VTT or SRT, merge final results shorter than this many seconds into the next cue. Defaults to 0 (no merging).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--subtitle-flush",
+        help="With VTT or SRT, flush the subtitle file after every this many cues. Defaults to 1.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--subtitle-fsync",
+        help="With VTT or SRT, also sync the subtitle file to disk after every this many cues. Defaults to 0 (only when the stream ends).",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--subtitle-window",
+        help="With VTT or SRT, also keep the cues from the last this many seconds in a <name>.live.srt/.vtt file, rewritten after every cue, for live players to poll. Defaults to 0 (off).",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--latency",
+        help="Print how long after its audio was sent each final transcript arrived. A p50/p95/p99 summary is always printed at the end of the stream. Defaults to False.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--latency-json",
+        help="Save per-utterance finalization latencies and their summary to this JSON file.",
+        default=None,
+    )
+    parser.add_argument(
+        "--speed",
+        help='How fast to stream a WAV file relative to real time, e.g. 1, 2 or 10, or "max" to send it as fast as possible. Only use speeds above 1 with servers that accept faster than real-time audio. Defaults to 1.',
+        default=1.0,
+        type=validate_speed,
+    )
+    parser.add_argument(
+        "--burst",
+        help="When streaming a WAV file, send this many seconds of audio immediately on connecting before pacing the rest. Defaults to 0.",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--url-packet-size",
+        help=f"When streaming from a URL, how many bytes to send in each packet. Defaults to {URL_PACKET_SIZE}.",
+        default=URL_PACKET_SIZE,
+        type=int,
+    )
+    parser.add_argument(
+        "--encoding",
+        help='Encoding to send WAV or microphone audio in: "linear16" as captured, or "mulaw" for half the bytes. Defaults to "linear16".',
+        default="linear16",
+        choices=["linear16", "mulaw"],
+    )
+    parser.add_argument(
+        "--resample",
+        help="Resample WAV or microphone audio to this rate before sending it. Requires NumPy. Defaults to the input's own rate.",
+        default=None,
+        type=int,
+        choices=TARGET_RATES,
+    )
+    parser.add_argument(
+        "--mono",
+        help="Mix WAV audio with several channels down to one before sending it. Requires NumPy.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--split-channels",
+        help="Stream each channel of a WAV file with several channels over its own connection, at the same pace, and merge the transcripts into one timeline labelled by channel.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--vad",
+        help="Hold back silent audio instead of sending it, with KeepAlive messages to keep the connection open, and shift result timestamps to match. Works with WAV files and the microphone, and requires NumPy.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--vad-threshold",
+        help="With --vad, the level in dBFS below which audio counts as silence. Defaults to -45.",
+        default=-45.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--vad-hangover",
+        help="With --vad, how many seconds to keep sending after speech stops. Defaults to 0.5.",
+        default=0.5,
+        type=float,
+    )
+    parser.add_argument(
+        "--vad-preroll",
+        help="With --vad, how many seconds of audio from before speech starts to send along with it. Defaults to 0.25.",
+        default=0.25,
+        type=float,
+    )
+    parser.add_argument(
+        "--keepalive-interval",
+        help="With --vad, how many seconds apart to send KeepAlive messages while audio is held back. Defaults to 5.",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--reconnect",
+        help="Each time the connection drops, make up to this many attempts to reconnect, waiting twice as long after each failed one, and replay the audio that has not been finalized yet. Works with WAV files and the microphone. Defaults to 0 (abort the stream).",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--replay-seconds",
+        help=f"With --reconnect, how many seconds of sent audio to keep for replaying. Defaults to {REPLAY_SECONDS}.",
+        default=REPLAY_SECONDS,
+        type=float,
+    )
+    parser.add_argument(
+        "--trace",
+        help="Append a timeline of each stream (connecting, first audio sent, first message, first final transcript, CloseStream, final metadata and the send lag of every chunk) to this file as OpenTelemetry-shaped JSON lines. See tracing.py.",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch",
+        help="Stream many inputs in one run instead of --input: either a directory (every WAV file under it) or a JSONL manifest with one {\"input\": ...} object per line. Inputs that already have results in --output-dir are skipped.",
+        default=None,
+        type=validate_batch,
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="With --batch, how many inputs to stream at once. Defaults to 4.",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="With --batch, where to write each input's results. Defaults to data/batch.",
+        default=os.path.join("data", "batch"),
+    )
     #Parse the host
     parser.add_argument(
         "--host",
@@ -380,46 +690,178 @@ def parse_args():
     return parser.parse_args()
 
 
+def stream_options(args):
+    """Returns the `run` options shared by every input."""
+    return {
+        "model": args.model,
+        "tier": args.tier,
+        "host": args.host,
+        "timestamps": args.timestamps,
+        "speed": args.speed,
+        "burst": args.burst,
+        "latency": args.latency,
+        "latency_json": args.latency_json,
+        "url_packet_size": args.url_packet_size,
+        "reconnect": args.reconnect,
+        "replay_seconds": args.replay_seconds,
+        "subtitle_flush": args.subtitle_flush,
+        "subtitle_fsync": args.subtitle_fsync,
+        "subtitle_window": args.subtitle_window,
+        "encoding": args.encoding,
+        "resample": args.resample,
+        "mono": args.mono,
+        "vad": args.vad,
+        "vad_threshold": args.vad_threshold,
+        "vad_hangover": args.vad_hangover,
+        "vad_preroll": args.vad_preroll,
+        "keepalive_interval": args.keepalive_interval,
+        "subtitle_max_chars": args.subtitle_max_chars,
+        "subtitle_max_duration": args.subtitle_max_duration,
+        "subtitle_min_duration": args.subtitle_min_duration,
+        "tracer": args.tracer,
+    }
+
+
+def load_batch(path):
+    """Reads the entries of a batch run.
+
+    `path` is either a directory, in which case every WAV file under it is an
+    entry, or a JSONL manifest with one entry per line. A manifest entry has an
+    `input` (WAV path or stream URL) and may set its own `id` (used to name
+    its results), `model`, `tier`, `format` and `timestamps`.
+    """
+    entries = []
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".wav"):
+                    filepath = os.path.join(root, name)
+                    entry_id = os.path.splitext(os.path.relpath(filepath, path))[0]
+                    entries.append({"input": filepath, "id": entry_id})
+        return entries
+
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "input" not in entry:
+                raise ValueError(f"Line {line_number} of {path} has no input.")
+            entry.setdefault(
+                "id", os.path.splitext(os.path.basename(entry["input"].rstrip("/")))[0]
+            )
+            entries.append(entry)
+
+    ids = Counter(entry["id"] for entry in entries)
+    duplicates = [entry_id for entry_id, count in ids.items() if count > 1]
+    if duplicates:
+        raise ValueError(
+            f'Entries in {path} share the id(s) {", ".join(duplicates)}. Please give them unique "id" values.'
+        )
+    return entries
+
+
+async def run_batch(key, args):
+    """Streams every entry of a batch, `args.concurrency` at a time.
+
+    Results are written to `<output dir>/<id>.json` (plus a subtitle file for
+    SRT/VTT). Entries that already have results are skipped, so an interrupted
+    batch picks up where it left off when rerun.
+    """
+    entries = load_batch(args.batch)
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    ssl_context = ssl.create_default_context()
+    counts = Counter()
+    print(f"🟢 Streaming {len(entries)} input(s), {args.concurrency} at a time")
+
+    async def process(entry):
+        result_path = os.path.join(args.output_dir, f'{entry["id"]}.json')
+        if os.path.exists(result_path):
+            counts["skipped"] += 1
+            return
+
+        input = entry["input"]
+        format = entry.get("format", args.format).lower()
+        options = stream_options(args)
+        options.update(
+            {key: entry[key] for key in ("model", "tier", "timestamps") if key in entry}
+        )
+        options.update(latency=False, latency_json=None, collect_transcripts=True)
+        if format == "vtt" or format == "srt":
+            options["subtitle_path"] = os.path.join(
+                args.output_dir, f'{entry["id"]}.{format}'
+            )
+
+        async with semaphore:
+            try:
+                os.makedirs(os.path.dirname(result_path), exist_ok=True)
+                if input.lower().startswith("http"):
+                    method = "url"
+                    options["url"] = input
+                elif input.lower().endswith("wav"):
+                    method = "wav"
+                    options.update(wav_params(input))
+                else:
+                    raise ValueError("only WAV files and stream URLs can be batched")
+
+                result = await run(
+                    key, method, format, quiet=True, ssl_context=ssl_context, **options
+                )
+                if result["duration"] is None:
+                    raise ValueError("the stream closed before its final metadata arrived")
+            except Exception as e:
+                counts["failed"] += 1
+                print(f'🔴 {entry["id"]}: {type(e).__name__} {e}')
+                return
+
+        result["input"] = input
+        # write the results atomically, so a partial file never counts as done
+        with open(f"{result_path}.tmp", "w") as f:
+            json.dump(result, f, indent=2)
+        os.replace(f"{result_path}.tmp", result_path)
+        counts["completed"] += 1
+        print(f'🟢 {entry["id"]}: {len(result["transcripts"])} transcript(s) saved to {result_path}')
+
+    await asyncio.gather(*(process(entry) for entry in entries))
+    print(
+        f'🟢 Batch finished: {counts["completed"]} completed, {counts["skipped"]} skipped, {counts["failed"]} failed'
+    )
+
+
 def main():
     """Entrypoint for the example."""
     # Parse the command-line arguments.
     args = parse_args()
     input = args.input
     format = args.format.lower()
-    host = args.host
+    # shared by every stream of the run
+    args.tracer = open_tracer(args.trace, "test_suite")
 
     try:
-        if input.lower().startswith("mic"):
-            asyncio.run(run(args.key, "mic", format, model=args.model, tier=args.tier, host=host, timestamps=args.timestamps))
+        if args.batch:
+            asyncio.run(run_batch(args.key, args))
+
+        elif input.lower().startswith("mic"):
+            asyncio.run(run(args.key, "mic", format, **stream_options(args)))
 
         elif input.lower().endswith("wav"):
             if os.path.exists(input):
-                # Open the audio file.
-                with wave.open(input, "rb") as fh:
-                    (
-                        channels,
-                        sample_width,
-                        sample_rate,
-                        num_samples,
-                        _,
-                        _,
-                    ) = fh.getparams()
-                    assert sample_width == 2, "WAV data must be 16-bit."
-                    data = fh.readframes(num_samples)
+                params = wav_params(input)
+                if args.split_channels and params["channels"] > 1:
+                    asyncio.run(
+                        run_channels(
+                            args.key, format, **params, **stream_options(args)
+                        )
+                    )
+                else:
                     asyncio.run(
                         run(
                             args.key,
                             "wav",
                             format,
-                            model=args.model,
-                            tier=args.tier,
-                            data=data,
-                            channels=channels,
-                            sample_width=sample_width,
-                            sample_rate=sample_rate,
-                            filepath=args.input,
-                            host=host,
-                            timestamps=args.timestamps,
+                            **params,
+                            **stream_options(args),
                         )
                     )
             else:
@@ -428,7 +870,7 @@ def main():
                 )
 
         elif input.lower().startswith("http"):
-            asyncio.run(run(args.key, "url", format, model=args.model, tier=args.tier, url=input, host=host, timestamps=args.timestamps))
+            asyncio.run(run(args.key, "url", format, url=input, **stream_options(args)))
 
         else:
             raise argparse.ArgumentTypeError(
@@ -453,6 +895,10 @@ def main():
             error_description = "The service has not transmitted a Text frame to the client within the timeout window. This may indicate an issue internally in Deepgram's systems or could be due to Deepgram not receiving enough audio data to transcribe a frame."
         elif e.reason == "NET-0001":
             error_description = "The service has not received a Binary frame from the client within the timeout window. This may indicate an internal issue in Deepgram's systems, the client's systems, or the network connecting them."
+        elif e.code == 1013:
+            error_description = "The server is at capacity and turned the connection away. Please try again later."
+        elif e.code == 1008:
+            error_description = "The stream went over a limit the server sets on sessions, such as their length."
 
         print(f"🔴 {error_description}")
         # TODO: update with link to streaming troubleshooting page once available
@@ -469,6 +915,9 @@ def main():
         print(f"🔴 ERROR: Something went wrong! {e}")
         return
 
+    finally:
+        args.tracer.close()
+
 
 if __name__ == "__main__":
     sys.exit(main() or 0)
@@ -0,0 +1,228 @@
+"""Per-stream timeline tracing, exported as OpenTelemetry-shaped JSONL spans.
+
+With `--trace FILE`, client.py, test_suite.py and server.py append one JSON
+line per finished span to FILE, in the shape of an OTLP/JSON span (trace and
+span IDs, start and end in Unix nanoseconds, typed attributes and timed
+events), so a load run's lines can be loaded into any OpenTelemetry tool or
+simply sorted and compared with jq. Times are taken from the monotonic clock
+and anchored to the wall clock once per process, so intervals within a
+process are exact and timelines from several processes on one machine line
+up.
+
+Clients send their span's W3C `traceparent` header when connecting, and the
+server's span for the connection joins the same trace, so both sides of a
+stream can be matched up.
+
+Tracing is off unless a file is given: every stream then gets the shared
+`NOOP_SPAN`, whose methods do nothing, and hot paths check `span.recording`
+before preparing anything to record.
+"""
+
+import json
+import os
+import time
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# Finished spans are written out in batches of this many lines, or when one
+# ends this many seconds after the last write
+FLUSH_SPANS = 64
+FLUSH_SECONDS = 1.0
+
+
+def attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON encodes 64-bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def encode_attributes(attributes):
+    return [
+        {"key": key, "value": attribute_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+def parse_traceparent(header):
+    """Returns the (trace ID, parent span ID) of a W3C traceparent header, or (None, None)."""
+    try:
+        version, trace_id, span_id, flags = header.split("-")
+    except (AttributeError, ValueError):
+        return None, None
+    if len(trace_id) != 32 or len(span_id) != 16:
+        return None, None
+    return trace_id, span_id
+
+
+class NoopSpan:
+    """Stands in for a span when tracing is off."""
+
+    recording = False
+
+    def event(self, name, **attributes):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def child(self, name, kind=INTERNAL, **attributes):
+        return self
+
+    def end(self, error=None):
+        pass
+
+    def traceparent(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer:
+    def span(self, name, parent=None, traceparent=None, kind=INTERNAL, **attributes):
+        return NOOP_SPAN
+
+    def close(self):
+        pass
+
+
+NOOP_TRACER = NoopTracer()
+
+
+class Span:
+    """One timed operation, with attributes and events, written out when it ends."""
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "attributes",
+        "events",
+        "ended",
+    )
+
+    recording = True
+
+    def __init__(self, tracer, name, trace_id, parent_id, kind, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.monotonic_ns()
+        self.attributes = attributes
+        # (monotonic ns, name, attributes), encoded only when the span ends
+        self.events = []
+        self.ended = False
+
+    def event(self, name, **attributes):
+        self.events.append((time.monotonic_ns(), name, attributes))
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def child(self, name, kind=INTERNAL, **attributes):
+        return self.tracer.span(name, parent=self, kind=kind, **attributes)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self, error=None):
+        if self.ended:
+            return
+        self.ended = True
+        self.tracer.export(self, time.monotonic_ns(), error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        return False
+
+
+class Tracer:
+    """Appends the spans of one process to a JSONL file.
+
+    Lines are written in batches, each with a single write to a file opened
+    for appending, so several processes can share one file.
+    """
+
+    def __init__(self, path, service):
+        self.path = path
+        self.resource = encode_attributes({"service.name": service, "process.pid": os.getpid()})
+        # converts monotonic nanoseconds to Unix nanoseconds
+        self.offset = time.time_ns() - time.monotonic_ns()
+        self.lines = []
+        self.last_flush = time.monotonic()
+
+    def span(self, name, parent=None, traceparent=None, kind=INTERNAL, **attributes):
+        """Starts a span, under `parent` or the remote parent in a `traceparent` header."""
+        if parent is not None and parent.recording:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = parse_traceparent(traceparent)
+        return Span(self, name, trace_id or os.urandom(16).hex(), parent_id, kind, attributes)
+
+    def export(self, span, end, error):
+        record = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start + self.offset),
+            "endTimeUnixNano": str(end + self.offset),
+            "attributes": encode_attributes(span.attributes),
+            "events": [
+                {
+                    "timeUnixNano": str(at + self.offset),
+                    "name": name,
+                    "attributes": encode_attributes(attributes),
+                }
+                for at, name, attributes in span.events
+            ],
+            # OTLP status codes: 1 is OK, 2 is ERROR
+            "status": {"code": 2, "message": f"{type(error).__name__}: {error}"} if error else {"code": 1},
+            "resource": {"attributes": self.resource},
+        }
+        self.lines.append(json.dumps(record, separators=(",", ":")))
+        if len(self.lines) >= FLUSH_SPANS or time.monotonic() - self.last_flush >= FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.lines:
+            return
+        data = "".join(line + "\n" for line in self.lines)
+        self.lines = []
+        with open(self.path, "a") as f:
+            f.write(data)
+
+    def close(self):
+        self.flush()
+
+
+def open_tracer(path, service):
+    """Returns a `Tracer` writing to `path`, or the no-op tracer if `path` is empty."""
+    return Tracer(path, service) if path else NOOP_TRACER
@@ -0,0 +1,130 @@
+"""Converts linear16 audio on its way to the server: downmix, resample, mu-law.
+
+Every stage works on whole chunks with NumPy and carries only the little
+state it needs (the resampler's filter history) from one chunk to the next,
+so each chunk goes out as soon as it comes in, just smaller.
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# How many zero crossings of the resampling filter's sinc are kept on each
+# side, and the Kaiser window's beta; more of either means a sharper cutoff
+# and more computation.
+FILTER_ZERO_CROSSINGS = 16
+FILTER_KAISER_BETA = 8.0
+
+
+def linear16_to_mulaw(samples):
+    """Encodes int16 samples as G.711 mu-law bytes."""
+    values = samples.astype(np.int32)
+    sign = np.where(values < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(values), 32635) + 0x84
+    # the segment is the position of the highest set bit above bit 7
+    exponent = np.floor(np.log2(magnitude >> 7)).astype(np.int32)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+class Resampler:
+    """Streaming polyphase resampler for frames of shape (samples, channels).
+
+    The rate changes by `up`/`down`; only the `up` filter phases that are
+    actually needed are evaluated for each output sample, and the last few
+    input samples are kept so that chunks join up seamlessly.
+    """
+
+    def __init__(self, rate_in, rate_out, channels):
+        divisor = math.gcd(rate_in, rate_out)
+        self.up = rate_out // divisor
+        self.down = rate_in // divisor
+
+        # a low-pass windowed sinc at the upsampled rate, split into phases
+        self.taps = math.ceil(2 * FILTER_ZERO_CROSSINGS * max(self.up, self.down) / self.up)
+        length = self.taps * self.up
+        cutoff = 0.5 / max(self.up, self.down)
+        t = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, FILTER_KAISER_BETA)
+        # unity gain through each phase
+        prototype *= self.up / prototype.sum()
+        # phases[p][k] weighs input sample i - k for outputs at phase p
+        self.phases = prototype.reshape(self.taps, self.up).T.copy()
+
+        self.history = np.zeros((self.taps - 1, channels))
+        # input samples consumed and output samples produced so far
+        self.consumed = 0
+        self.produced = 0
+        self.offsets = np.arange(self.taps)
+
+    def process(self, frames):
+        buffer = np.concatenate((self.history, frames))
+        total = self.consumed + len(frames)
+
+        # every output whose newest input sample has arrived
+        end = -(-total * self.up // self.down)
+        n = np.arange(self.produced, end)
+        position = n * self.down
+        newest = position // self.up - self.consumed + self.taps - 1
+        windows = buffer[newest[:, None] - self.offsets[None, :]]
+        output = np.einsum("ok,okc->oc", self.phases[position % self.up], windows)
+
+        self.history = buffer[len(buffer) - (self.taps - 1) :]
+        self.consumed = total
+        self.produced = end
+        return output
+
+
+class Transcoder:
+    """Turns linear16 chunks into the format that will be sent.
+
+    The audio is downmixed to mono if `mono`, resampled to `sample_rate` if
+    that differs, and encoded as `encoding` ("linear16" or "mulaw"). `query`
+    holds the matching query parameters and `byte_rate` the bytes per second
+    of the result.
+    """
+
+    def __init__(self, sample_rate, channels, encoding="linear16", target_rate=None, mono=False):
+        if np is None:
+            raise RuntimeError("Transcoding requires NumPy (pip install numpy)")
+        self.channels_in = channels
+        self.channels = 1 if mono else channels
+        self.sample_rate = target_rate or sample_rate
+        self.encoding = encoding
+        self.resampler = None
+        if self.sample_rate != sample_rate:
+            self.resampler = Resampler(sample_rate, self.sample_rate, self.channels)
+
+        sample_width = 1 if encoding == "mulaw" else 2
+        self.byte_rate = sample_width * self.channels * self.sample_rate
+        self.query = f"&channels={self.channels}&sample_rate={self.sample_rate}&encoding={encoding}"
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def process(self, chunk):
+        self.bytes_in += len(chunk)
+        samples = np.frombuffer(chunk, dtype="<i2").reshape(-1, self.channels_in)
+        if self.channels != self.channels_in or self.resampler:
+            frames = samples.astype(np.float64)
+            if self.channels != self.channels_in:
+                frames = frames.mean(axis=1, keepdims=True)
+            if self.resampler:
+                frames = self.resampler.process(frames)
+            samples = np.clip(np.rint(frames), -32768, 32767).astype("<i2")
+
+        if self.encoding == "mulaw":
+            data = linear16_to_mulaw(samples.ravel()).tobytes()
+        else:
+            data = samples.tobytes()
+        self.bytes_out += len(data)
+        return data
+
+    def report(self):
+        ratio = self.bytes_out / self.bytes_in if self.bytes_in else 0
+        return (
+            f"sent {self.bytes_out} bytes for {self.bytes_in} bytes of input ({ratio:.0%}) "
+            f"as {self.encoding}, {self.sample_rate} Hz, {self.channels} channel(s)"
+        )
@@ -0,0 +1,145 @@
+"""An energy-based silence gate for the audio test_suite.py and client.py send (`--vad`).
+
+Silent stretches of linear16 audio are held back instead of sent, and
+KeepAlive messages keep the connection open meanwhile. Since the server then
+only hears the audio that was sent, the timestamps of its results are mapped
+back onto the original audio's timeline with `rebase()`.
+"""
+
+import bisect
+import time
+from collections import deque
+
+import codec
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The gate measures energy over blocks of this many seconds; a chunk is
+# speech if any of its blocks is above the threshold.
+BLOCK_SECONDS = 0.02
+
+
+class SilenceGate:
+    """Decides, chunk by chunk, which audio is worth sending.
+
+    A chunk is speech when any 20ms block in it is louder than `threshold`
+    dBFS. Sending carries on for `hangover` seconds after the last speech,
+    and the `preroll` seconds of audio before speech starts are sent along
+    with it, so word onsets aren't clipped. While audio is held back, `send()`
+    sends a KeepAlive every `keepalive` seconds.
+    """
+
+    def __init__(
+        self,
+        byte_rate,
+        frame_size,
+        threshold=-45.0,
+        hangover=0.5,
+        preroll=0.25,
+        keepalive=5.0,
+    ):
+        if np is None:
+            raise RuntimeError("--vad requires NumPy (pip install numpy)")
+        self.byte_rate = byte_rate
+        self.frame_size = frame_size
+        self.block_samples = max(
+            1, int(byte_rate * BLOCK_SECONDS) // frame_size * (frame_size // 2)
+        )
+        # compare mean squares of samples normalized to full scale
+        self.threshold = (10 ** (threshold / 20)) ** 2
+        self.hangover = hangover
+        self.preroll = preroll
+        self.keepalive = keepalive
+
+        self.source_bytes = 0
+        self.sent_bytes = 0
+        # seconds since the last speech, starting out as silence
+        self.quiet_for = float("inf")
+        self.held = deque()
+        self.held_bytes = 0
+        self.last_sent = time.monotonic()
+
+        # where each stretch of sent audio starts on the sent timeline, and
+        # how far it has to be shifted to land on the original timeline
+        self.sent_starts = [0.0]
+        self.shifts = [0.0]
+
+        self.suppressed_bytes = 0
+        self.keepalives = 0
+
+    def is_speech(self, chunk):
+        samples = np.frombuffer(chunk, dtype="<i2")
+        usable = len(samples) - len(samples) % self.block_samples
+        if usable:
+            blocks = samples[:usable].reshape(-1, self.block_samples)
+        else:
+            blocks = samples.reshape(1, -1)
+        levels = (blocks.astype(np.float32) / 32768.0) ** 2
+        return bool((levels.mean(axis=1) > self.threshold).any())
+
+    async def send(self, chunk, send_audio, send_text):
+        """Sends `chunk` (through the async callables), unless it's silence."""
+        duration = len(chunk) / self.byte_rate
+        if self.is_speech(chunk):
+            self.quiet_for = 0.0
+        else:
+            self.quiet_for += duration
+
+        if self.quiet_for > self.hangover:
+            # hold on to the latest audio in case speech follows
+            self.held.append(bytes(chunk))
+            self.held_bytes += len(chunk)
+            self.source_bytes += len(chunk)
+            while self.held and self.held_bytes - len(self.held[0]) >= self.preroll * self.byte_rate:
+                dropped = self.held.popleft()
+                self.held_bytes -= len(dropped)
+                self.suppressed_bytes += len(dropped)
+
+            if time.monotonic() - self.last_sent >= self.keepalive:
+                await send_text(codec.dumps({"type": "KeepAlive"}))
+                self.keepalives += 1
+                self.last_sent = time.monotonic()
+            return
+
+        # the pre-roll goes out first, followed by this chunk
+        pieces = list(self.held) + [chunk]
+        resumed_at = self.source_bytes - self.held_bytes
+        self.held.clear()
+        self.held_bytes = 0
+        self.source_bytes += len(chunk)
+
+        shift = (resumed_at - self.sent_bytes) / self.byte_rate
+        if shift != self.shifts[-1]:
+            self.sent_starts.append(self.sent_bytes / self.byte_rate)
+            self.shifts.append(shift)
+
+        for piece in pieces:
+            await send_audio(piece)
+            self.sent_bytes += len(piece)
+        self.last_sent = time.monotonic()
+
+    def source_time(self, sent_time):
+        """Maps a time in the sent audio onto the original audio."""
+        index = bisect.bisect_right(self.sent_starts, sent_time) - 1
+        return sent_time + self.shifts[max(0, index)]
+
+    def rebase(self, res):
+        """Moves the timestamps of a `codec.Result` onto the original audio."""
+        end = self.source_time(res.end)
+        res.start = self.source_time(res.start)
+        res.duration = max(0.0, end - res.start)
+        for word in res.words:
+            word.start = self.source_time(word.start)
+            word.end = self.source_time(word.end)
+
+    def report(self):
+        # whatever is still held at the end of the stream is never sent
+        suppressed = self.suppressed_bytes + self.held_bytes
+        saved = suppressed / self.source_bytes if self.source_bytes else 0
+        return (
+            f"held back {suppressed} of {self.source_bytes} bytes ({saved:.0%}), "
+            f"sent {self.keepalives} KeepAlive message(s)"
+        )